@@ -0,0 +1,87 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# Command line interface to calc_restrictions_batch. Each line of the input is a JSON object
+#   {"restriction_bounds": {...}, "recipe_ingredients": [...], "recipe_other": [...], "id": ...}
+# where id is optional, and is copied to the output. Each line of the output is a JSON object
+#   {"line": ..., "id": ..., "calc_bounds": {...} or null, "error": null or "..."}
+# and the lines are in the same order as the input. For example:
+#   python batch.py recipes.jsonl -o bounds.jsonl --workers 4
+
+import argparse
+import json
+import sys
+from collections import deque
+
+import calculations
+
+def read_jobs(lines, pending):
+    '''Generator yielding the jobs (restriction_bounds, recipe_ingredients, recipe_other) given by lines. For each
+       nonempty line, the list [line number, id, error] is appended to pending, where error is None for lines
+       that are yielded as jobs, and otherwise describes what's wrong with the line'''
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        entry = [number, None, None]
+        pending.append(entry)
+        try:
+            job = json.loads(line)
+            if isinstance(job, dict):
+                entry[1] = job.get('id')
+            if not (isinstance(job, dict) and isinstance(job.get('restriction_bounds'), dict)
+                    and isinstance(job.get('recipe_ingredients'), list) and isinstance(job.get('recipe_other', []), list)):
+                raise ValueError('expected an object with restriction_bounds, recipe_ingredients and recipe_other')
+        except ValueError as e:
+            entry[2] = 'Invalid line: ' + str(e)
+            continue
+        yield job['restriction_bounds'], job['recipe_ingredients'], job.get('recipe_other', [])
+
+def write_result(output, entry, calc_bounds=None):
+    number, job_id, error = entry
+    output.write(json.dumps({'line': number, 'id': job_id, 'calc_bounds': calc_bounds, 'error': error}) + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calculate the restrictions for the recipes in a JSON lines file')
+    parser.add_argument('input', nargs='?', default='-', help='input file (default: standard input)')
+    parser.add_argument('-o', '--output', default='-', help='output file (default: standard output)')
+    parser.add_argument('--backend', default='simplex', choices=sorted(calculations.RecipeModel.backends))
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--stats', action='store_true', help='print the statistics to standard error at the end')
+    args = parser.parse_args(argv)
+
+    lines = sys.stdin if args.input == '-' else open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    pending = deque()      # the lines that have been read, but whose results haven't been written
+    stats = {}
+    jobs = read_jobs(lines, pending)
+    for result in calculations.calc_restrictions_batch(jobs, args.backend, args.workers, args.chunk_size, stats):
+        while pending[0][2] is not None:        # invalid lines read before this job
+            write_result(output, pending.popleft())
+        entry = pending.popleft()
+        entry[2] = result['error']
+        write_result(output, entry, result['calc_bounds'])
+    while pending:
+        write_result(output, pending.popleft())
+    if output is not sys.stdout:
+        output.close()
+    if args.stats:
+        print(json.dumps(stats), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# Benchmarks for calc_restrictions. Synthetic libraries of oxides and ingredients are generated from a seed, by adding
+# random oxides and ingredients to those in restrictions.py, and random recipes (subsets of the ingredients, with
+# bounds taken from a few templates) are calculated with each backend and mode. The results are written as JSON,
+# so that runs can be compared. Before anything else, the demo in the README is checked with every configuration.
+#   python benchmark.py --sizes 20x15 200x30 2000x60 --recipes 20 -o benchmark.json
+
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+from restrictions import *
+import calculations
+import compositions
+
+# The modes in which the backends are run: the options passed to calc_restrictions
+modes = {'default': {},
+         'no_harvest': {'harvest': False},
+         'full': {'presolve': False, 'harvest': False}}
+
+# The output of the demo given in the README
+demo_calc_bounds = {'umf_SiO2': [3.0, 4.0], 'umf_Al2O3': [0.3, 0.5], 'umf_CaO': [1.0, 1.0],
+                    'mass_perc_SiO2': [64.37, 72.7413], 'mass_perc_Al2O3': [10.0961, 16.0642], 'mass_perc_CaO': [16.142, 21.0089],
+                    'mole_perc_SiO2': [67.7419, 75.0], 'mole_perc_Al2O3': [6.12245, 10.0], 'mole_perc_CaO': [18.1818, 23.2558],
+                    'ingredient_0': [38.1822, 52.0639], 'ingredient_1': [21.3466, 33.6225], 'ingredient_7': [24.5522, 31.2068],
+                    'other_0': [7.0, 12.0]}
+
+def same_bounds(calc_bounds, expected, tol=1e-4):
+    'Return True if the two results agree to within the relative tolerance tol (or are both None)'
+    if calc_bounds is None or expected is None:
+        return calc_bounds is expected
+    return list(calc_bounds) == list(expected) and all(abs(calc_bounds[key][i] - expected[key][i]) <= tol*max(1, abs(expected[key][i]))
+                                                       for key in expected for i in [0,1])
+
+# SECTION 1
+# Synthetic libraries and recipes
+
+def synthetic_library(n_ingredients, n_oxides, seed=0):
+    '''Return an oxide_dict and ingredient_dict with n_oxides oxides and n_ingredients ingredients, consisting of those
+       in restrictions.py, together with random oxides (named 'X1O', 'X2O', etc) and ingredients. Each random ingredient
+       consists of one to five oxides, making up 80 to 100 percent of its weight, and about half of its oxides are
+       taken from the common ones, so that recipes have a realistic overlap'''
+
+    if n_ingredients < len(ingredient_dict) or n_oxides < len(oxide_dict):
+        raise ValueError('A library has at least %i ingredients and %i oxides' % (len(ingredient_dict), len(oxide_dict)))
+    rng = random.Random(seed)
+    oxides = dict(oxide_dict)
+    for k in range(1, n_oxides - len(oxide_dict) + 1):
+        oxides['X%iO' % k] = Oxide(round(rng.uniform(30, 250), 3), int(rng.random() < 0.4))
+    common = list(oxide_dict)
+    names = list(oxides)
+    ingredients = dict(ingredient_dict)
+    for r in range(len(ingredient_dict), n_ingredients):
+        comp_oxides = set()
+        for k in range(rng.randint(1, 5)):
+            comp_oxides.add(rng.choice(common if rng.random() < 0.5 else names))
+        weights = [rng.random() for ox in comp_oxides]
+        total = rng.uniform(80, 100)
+        comp = {ox: round(total*w/sum(weights), 2) for ox, w in zip(sorted(comp_oxides), weights)}
+        ingredients[str(r)] = Ingredient('Synthetic %i' % r, comp)
+    return oxides, ingredients
+
+def random_recipe(model, rng, max_size=8, templates=('default', 'umf', 'ingredients', 'analysis')):
+    '''Return a random recipe (restriction_bounds, recipe_ingredients, recipe_other) for model, with between 2 and
+       max_size ingredients, at least one of which contains a flux. The bounds are the defaults, changed according
+       to a template chosen from templates: 'umf' and 'ingredients' tighten some of the oxide UMF or ingredient
+       bounds at random, and 'analysis' sets the bounds around the analysis of random amounts of the ingredients
+       (see analysis_bounds), so the problems are tight or degenerate, which is where solvers tend to disagree'''
+
+    fluxes = [index for index, comp in model.ingredient_compositions.items()
+              if any(model.oxide_dict[ox].flux for ox in comp if ox in model.oxide_dict)]
+    ingredients = [rng.choice(fluxes)]
+    others = [index for index in model.ingredient_compositions if index != ingredients[0]]
+    ingredients += rng.sample(others, rng.randint(1, max_size - 1))
+    other = rng.sample(sorted(model.other_dict), rng.randint(0, 2))
+    recipe_oxides = model.recipe_oxides(ingredients)
+
+    restriction_bounds = {}
+    for ox in recipe_oxides:
+        for t in ['umf_', 'mass_perc_', 'mole_perc_']:
+            res = model.restr_dict[t+ox]
+            restriction_bounds[t+ox] = [res.default_low, res.default_upp]
+    for index in ingredients:
+        restriction_bounds['ingredient_'+index] = [0, 100]
+    for index in other:
+        res = model.restr_dict['other_'+index]
+        restriction_bounds['other_'+index] = [res.default_low, res.default_upp]
+
+    template = rng.choice(templates)
+    if template == 'umf':
+        if 'SiO2' in recipe_oxides:
+            restriction_bounds['umf_SiO2'] = [rng.choice([0, 1, 2]), rng.choice([3, 4, 6])]
+        if 'Al2O3' in recipe_oxides:
+            restriction_bounds['umf_Al2O3'] = [0, rng.choice([0.3, 0.5, 1])]
+        for ox in recipe_oxides:
+            if model.oxide_dict[ox].flux and rng.random() < 0.3:
+                restriction_bounds['umf_'+ox] = [0, rng.choice([0.3, 0.6])]
+    elif template == 'ingredients':
+        for index in ingredients:
+            if rng.random() < 0.3:
+                restriction_bounds['ingredient_'+index] = [rng.choice([0, 5, 10]), rng.choice([30, 60, 100])]
+    elif template == 'analysis':
+        analysis_bounds(model, rng, restriction_bounds, ingredients)
+    return restriction_bounds, ingredients, other
+
+def analysis_bounds(model, rng, restriction_bounds, recipe_ingredients, equal=0.3):
+    '''Set the bounds in restriction_bounds around the values of the restrictions for random amounts of the recipe's
+       ingredients. About half of the bounds are set to within a margin of between 0.1 and 50 percent of the value
+       (or to the value itself, for a fraction equal of them), and the others are widened to include it, so the
+       recipe is feasible, unless a restriction is undefined for those amounts'''
+    comps = compositions.CompositionMatrix(model.oxide_dict, {index: model.ingredient_compositions[index]
+                                                              for index in recipe_ingredients}, model.other_dict)
+    weights = [rng.random() for index in recipe_ingredients]
+    values = comps.restriction_values(comps.analyze_recipes([weights], recipe_ingredients), recipe_ingredients)
+    for key, bounds in restriction_bounds.items():
+        value = float(values[key][0])
+        if not math.isfinite(value):
+            continue
+        if rng.random() < 0.5:
+            margin = 0 if rng.random() < equal else 10**rng.uniform(-3, math.log10(0.5))
+            restriction_bounds[key] = [value*(1 - margin), value*(1 + margin)]
+        else:
+            restriction_bounds[key] = [min(bounds[0], value), max(bounds[1], value)]
+
+# SECTION 2
+# Running the benchmarks
+
+def check_demo(backend, mode):
+    'Return True if calc_restrictions gives the README output for the demo with the given backend and mode'
+    calc_bounds = calculations.calc_restrictions(calculations.demo_res_bounds, calculations.demo_ingredients,
+                                                 calculations.demo_other, backend, **modes[mode])
+    return same_bounds(calc_bounds, demo_calc_bounds)
+
+def check_tight(backends, mode_names, n_recipes=10, seed=0, max_size=8):
+    '''Return a dictionary giving, for each backend/mode, the number of tight recipes (see analysis_bounds) on which it
+       differs from 'highs' in the default mode. The recipes are drawn from a library of 300 ingredients and 40 oxides,
+       large enough that the tableaux are badly scaled, so this checks the scaling and tolerances of the 'simplex'
+       backend, and its fallback to HiGHS'''
+    model = calculations.RecipeModel(*synthetic_library(300, 40, 7), other_dict)
+    rng = random.Random(seed)
+    recipes = [random_recipe(model, rng, max_size, ['analysis']) for r in range(n_recipes)]
+    reference = [model.calc_result(*recipe, 'highs')[0] for recipe in recipes]
+    mismatches = {}
+    for backend in backends:
+        for mode in (['default'] if backend == 'pulp' else mode_names):
+            results = [model.calc_result(*recipe, backend, **modes[mode])[0] for recipe in recipes]
+            mismatches[backend+'/'+mode] = sum(not same_bounds(result, ref) for result, ref in zip(results, reference))
+    return mismatches
+
+def run_config(model, recipes, backend, mode, memory_calls=5):
+    '''Calculate each recipe with the given backend and mode, returning the results and a dictionary of measurements.
+       Wall time and solves are measured over all the recipes; peak memory (as traced by tracemalloc, so only
+       memory allocated by Python) is measured over the first memory_calls recipes, in a second pass, since
+       tracing slows everything down'''
+
+    results = []
+    stats = {}
+    start = time.perf_counter()
+    for restriction_bounds, recipe_ingredients, recipe_other in recipes:
+        calc_bounds, error = model.calc_result(restriction_bounds, recipe_ingredients, recipe_other, backend,
+                                               stats=stats, **modes[mode])
+        results.append(calc_bounds)
+    wall_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    for restriction_bounds, recipe_ingredients, recipe_other in recipes[:memory_calls]:
+        model.calc_result(restriction_bounds, recipe_ingredients, recipe_other, backend, **modes[mode])
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    solves = stats.get('solves', 0)
+    measurements = {'calls': len(recipes), 'failures': results.count(None), 'wall_time': wall_time,
+                    'time_per_call': wall_time/max(len(recipes), 1), 'solves_per_call': solves/max(len(recipes), 1),
+                    'time_per_solve': wall_time/solves if solves else None, 'peak_memory_kb': peak_memory/1024,
+                    'stats': stats}
+    return results, measurements
+
+def run_benchmark(sizes, backends=('highs', 'simplex'), mode_names=tuple(modes), n_recipes=20, max_size=8, seed=0,
+                  log=None, n_tight=10):
+    '''Run the benchmarks for each (n_ingredients, n_oxides) in sizes, with n_recipes random recipes per library, and
+       return the report as a dictionary. Results that differ from those of the first configuration run on a
+       library are counted as mismatches. The 'pulp' backend is only run in the default mode, since it ignores the
+       options. The demo, and n_tight tight recipes (see check_tight), are checked first.
+       If log is a file, a line is written to it as each configuration finishes'''
+
+    report = {'seed': seed, 'recipes': n_recipes, 'max_recipe_size': max_size, 'backends': list(backends),
+              'modes': list(mode_names), 'platform': platform.platform(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'scipy': scipy.__version__, 'demo': {}, 'tight': {}, 'results': []}
+
+    for backend in backends:
+        for mode in (['default'] if backend == 'pulp' else mode_names):
+            report['demo'][backend+'/'+mode] = check_demo(backend, mode)
+    if n_tight > 0:
+        report['tight'] = check_tight(backends, mode_names, n_tight, seed, max_size)
+
+    for n_ingredients, n_oxides in sizes:
+        oxides, ingredients = synthetic_library(n_ingredients, n_oxides, seed)
+        start = time.perf_counter()
+        model = calculations.RecipeModel(oxides, ingredients, other_dict)
+        build_time = time.perf_counter() - start
+        rng = random.Random(seed)
+        recipes = [random_recipe(model, rng, max_size) for r in range(n_recipes)]
+        reference = None
+        for backend in backends:
+            for mode in (['default'] if backend == 'pulp' else mode_names):
+                results, measurements = run_config(model, recipes, backend, mode)
+                if reference is None:
+                    reference = results
+                measurements['mismatches'] = sum(not same_bounds(result, ref) for result, ref in zip(results, reference))
+                entry = {'ingredients': n_ingredients, 'oxides': n_oxides, 'build_time': build_time,
+                         'backend': backend, 'mode': mode}
+                entry.update(measurements)
+                report['results'].append(entry)
+                if log is not None:
+                    print('%5i x %3i  %-8s %-10s %8.2f ms/call %7.1f solves/call %8.3f ms/solve %8.0f KB  %i failed, %i mismatches'
+                          % (n_ingredients, n_oxides, backend, mode, 1000*entry['time_per_call'], entry['solves_per_call'],
+                             1000*(entry['time_per_solve'] or 0), entry['peak_memory_kb'], entry['failures'],
+                             entry['mismatches']), file=log)
+    return report
+
+def parse_size(size):
+    'Parse a library size of the form 2000x60 (ingredients x oxides)'
+    n_ingredients, n_oxides = size.lower().split('x')
+    return int(n_ingredients), int(n_oxides)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark calc_restrictions on synthetic libraries')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[(20, 15), (200, 30), (2000, 60)],
+                        help='library sizes, as ingredients x oxides (default: 20x15 200x30 2000x60)')
+    parser.add_argument('--backends', nargs='+', default=['highs', 'simplex'], choices=sorted(calculations.RecipeModel.backends))
+    parser.add_argument('--modes', nargs='+', default=list(modes), choices=list(modes))
+    parser.add_argument('--recipes', type=int, default=20, help='number of random recipes per library')
+    parser.add_argument('--max-recipe-size', type=int, default=8)
+    parser.add_argument('--tight-recipes', type=int, default=10,
+                        help='number of tight recipes on which the backends are checked against highs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='benchmark.json')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.sizes, args.backends, args.modes, args.recipes, args.max_recipe_size, args.seed,
+                           sys.stdout, args.tight_recipes)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=1)
+    if not all(report['demo'].values()):
+        print('The demo output differs from the README for:', [name for name, ok in report['demo'].items() if not ok])
+        sys.exit(1)
+    if any(report['tight'].values()):
+        print('These configurations differ from highs on tight recipes:',
+              {name: n for name, n in report['tight'].items() if n})
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# A cache for the results of calc_restrictions. The same recipe is often calculated again (undo and redo,
+# reopening a recipe, comparing variants), so results are stored under a key made from the canonical form
+# of the inputs, together with the data of the model they depend on. Only the compositions of the recipe's
+# ingredients go into the key, so changing an ingredient only affects the entries for recipes that use it.
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def canonical_inputs(model, restriction_bounds, recipe_ingredients, recipe_other, backend):
+    '''Return a tuple that determines the result of model.calc_restrictions(restriction_bounds, recipe_ingredients,
+       recipe_other, backend): the sorted inputs, the compositions of the ingredients, the oxides in the recipe,
+       the definitions of the restrictions that are bounded, and the other restrictions that affect the problem.
+       Other restrictions with a negative coefficient are included, since they're constrained to be nonnegative'''
+
+    ingredients = sorted(set(recipe_ingredients))
+    oxides = set()
+    for index in ingredients:
+        oxides.update(model.ingredient_compositions[index])
+    oxides = sorted(oxides.intersection(model.oxide_dict))
+    other = sorted(set(recipe_other))
+
+    bounds = sorted((key, float(low), float(upp)) for key, (low, upp) in restriction_bounds.items())
+    restrictions = [(key, model.restr_dict[key].objective_func, model.restr_dict[key].normalization)
+                    for key, low, upp in bounds]
+    compositions = [(index, sorted((ox, float(value)) for ox, value in model.ingredient_compositions[index].items()
+                                   if ox in model.oxide_dict)) for index in ingredients]
+    oxide_data = [(ox, float(model.oxide_dict[ox].molar_mass), model.oxide_dict[ox].flux) for ox in oxides]
+    other_data = [(index, ot.numerator, ot.normalization) for index, ot in sorted(model.other_dict.items())
+                  if index in other or 'other_'+index in restriction_bounds or min(ot.numerator.coefs.values()) < 0]
+
+    return (backend, ingredients, other, bounds, restrictions, compositions, oxide_data, other_data)
+
+class ResultCache:
+    '''An LRU cache of calc_restrictions results, holding at most size entries in memory, each for at most
+       max_age seconds (if max_age isn't None). If path is given, entries are also written to an SQLite
+       database there, so they survive restarts. When it holds more than disk_size entries, the least recently
+       used are deleted, down to nine tenths of disk_size, so it's only pruned once in a while. stats records
+       the numbers of hits (of which disk_hits were found on disk, not in memory), misses (found in neither)
+       and evictions, so every get counts as exactly one hit or one miss. Failed calculations, which return None,
+       aren't cached, so their error messages are printed every time'''
+
+    def __init__(self, size=1000, max_age=None, path=None, disk_size=100000):
+
+        self.size = size
+        self.max_age = max_age
+        self.disk_size = disk_size
+        self.entries = OrderedDict()      # key -> (time stored, result), least recently used first
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'evictions': 0}
+        self.db = None
+        self.disk_count = 0               # the number of entries in the database
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT, stored REAL, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self.db.commit()
+            self.disk_count = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def key(self, model, restriction_bounds, recipe_ingredients, recipe_other, backend='simplex'):
+        canonical = canonical_inputs(model, restriction_bounds, recipe_ingredients, recipe_other, backend)
+        return hashlib.sha256(repr(canonical).encode()).hexdigest()
+
+    def expired(self, stored, now):
+        return self.max_age is not None and now - stored > self.max_age
+
+    def get(self, key, restriction_bounds):
+        '''Return the cached result for key, with its entries in the order of restriction_bounds,
+           or None if there isn't one'''
+        now = time.time()
+        with self.lock:
+            result = None
+            if key in self.entries:
+                stored, result = self.entries[key]
+                if self.expired(stored, now):
+                    del self.entries[key]
+                    self.stats['evictions'] += 1
+                    result = None
+                else:
+                    self.entries.move_to_end(key)
+            if result is None and self.db is not None:
+                row = self.db.execute('SELECT result, stored FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None and not self.expired(row[1], now):
+                    result = json.loads(row[0])
+                    self.db.execute('UPDATE results SET used = ? WHERE key = ?', (now, key))
+                    self.db.commit()
+                    self.store(key, row[1], result)
+                    self.stats['disk_hits'] += 1
+            if result is None:
+                self.stats['misses'] += 1
+                return
+            self.stats['hits'] += 1
+            return {res_key: list(result[res_key]) for res_key in restriction_bounds}
+
+    def put(self, key, calc_bounds):
+        if calc_bounds is None:
+            return
+        now = time.time()
+        result = {res_key: list(bounds) for res_key, bounds in calc_bounds.items()}
+        with self.lock:
+            self.store(key, now, result)
+            if self.db is not None:
+                if self.db.execute('SELECT 1 FROM results WHERE key = ?', (key,)).fetchone() is None:
+                    self.disk_count += 1
+                self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, json.dumps(result), now, now))
+                if self.disk_count > self.disk_size:
+                    self.prune()
+                self.db.commit()
+
+    def prune(self):
+        '''Delete the least recently used entries of the database, down to nine tenths of disk_size. The entries are
+           counted again first, since other processes may share the database'''
+        self.disk_count = self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        excess = self.disk_count - self.disk_size*9//10
+        if self.disk_count > self.disk_size and excess > 0:
+            self.db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+            self.disk_count -= excess
+
+    def store(self, key, stored, result):
+        'Add an entry to the memory cache, evicting the least recently used entries if it is full'
+        self.entries[key] = (stored, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            if self.db is not None:
+                self.db.execute('DELETE FROM results')
+                self.db.commit()
+                self.disk_count = 0
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
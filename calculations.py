@@ -17,135 +17,385 @@
 # Contact: pi.mostert@gmail.com
 
 from pulp import *
+import pulp
+
+import copy
+import numbers
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
 from restrictions import *
+import lpmatrix
+import instrumentation
+import sampler
 #from pulp2dim import *
 
-# SECTION 1
-# Set up variables and universal restrictions for LP problem
-
-prob = pulp.LpProblem('Glaze recipe', pulp.LpMaximize)
 solver = GLPK()
-lp_var = {}     # dictionary for the variables in the linear programming problem prob.
-
-for total in ['ingredient_total', 'fluxes_total', 'ox_mass_total', 'ox_mole_total']:
-    lp_var[total] = pulp.LpVariable(total, 0, None, pulp.LpContinuous)           # used to normalize
-
-for index in ingredient_dict:
-    ing = 'ingredient_'+index
-    lp_var[ing] = pulp.LpVariable(ing, 0, None, pulp.LpContinuous)
-    
-for ox in oxide_dict:
-    lp_var['mole_'+ox] = pulp.LpVariable('mole_'+ox, 0, None, pulp.LpContinuous)
-    lp_var['mass_'+ox] = pulp.LpVariable('mass_'+ox, 0, None, pulp.LpContinuous)
-    prob += lp_var['mole_'+ox]*oxide_dict[ox].molar_mass == lp_var['mass_'+ox]   # relate mole percent and unity
-    prob += sum(ingredient_compositions[index][ox]*lp_var['ingredient_'+index]/100 \
-                for index in ingredient_dict if ox in ingredient_compositions[index]) \
-            == lp_var['mass_'+ox], ox     # relate ingredients and oxides
-
-for index in other_dict:
-    ot = 'other_'+index
-    coefs = other_dict[index].numerator_coefs
-    linear_combo = [(lp_var[key], coefs[key]) for key in coefs]
-    lp_var[ot] = pulp.LpVariable(ot, 0, None, pulp.LpContinuous)
-    prob += lp_var[ot] == LpAffineExpression(linear_combo)         # relate this variable to the other variables.
-
-prob += lp_var['ingredient_total'] == sum(lp_var['ingredient_'+index] for index in ingredient_dict), 'ing_total'
-prob += lp_var['fluxes_total'] == sum(oxide_dict[ox].flux*lp_var['mole_'+ox] for ox in oxide_dict)
-prob += lp_var['ox_mass_total'] == sum(lp_var['mass_'+ox] for ox in oxide_dict)
-prob += lp_var['ox_mole_total'] == sum(lp_var['mole_'+ox] for ox in oxide_dict)
 
-# SECTION 2
+# SECTION 1
+
+res_types = {umf_normalization: 'UMF ', mass_perc_normalization: '% weight ', mole_perc_normalization: '% molar '}
 
 def print_res_type(normalization):   # Used to display error message
-    if normalization == "lp_var['fluxes_total']":
-        prt = 'UMF '
-    elif normalization == "0.01*lp_var['ox_mass_total']":
-        prt = '% weight '
-    elif normalization == "0.01*lp_var['ox_mole_total']":
-        prt = '% molar '
-    else:
-        prt = ''
-    return prt
-
-# Define calc function
-
-def calc_restrictions(restriction_bounds, recipe_ingredients, recipe_other):
-    ''' restriction bounds must be a dictionary with keys of the form
-        'umf_'+ox, 'mass_perc_'+ox, 'mole_perc_'+ox, where ox is in recipe_oxides (defined below),
-        'ingredient_'+index, where index is in recipe_ingredients
-        or 'other_'+index, where index is in recipe_other.
-        The values of restriction_bounds are of the form [low,upp], where low and upp are,
-        respectively, the user-defined lower and upper bounds for that restriction.
-        recipe_ingredients and recipe_other are lists of indices representing the ingredients
-        and other restrictions used in the recipe'''
-
-    global prob
-
-    recipe_oxides = set()
-    for index in recipe_ingredients:
-        recipe_oxides = recipe_oxides.union(set(ingredient_compositions[index]))  # Is there a more efficient way to do this?
-     
-# First, test for obvious errors
-
-    recipe_fluxes = [ox for ox in recipe_oxides if oxide_dict[ox].flux == 1]
-
-    if sum(oxide_dict[ox].flux for ox in recipe_oxides) == 0:
-        print('No flux! You have to give a flux.')
-        return
-
-    for res_key, bounds in restriction_bounds.items():
-        if bounds[0] > bounds[1]:
-            res = restr_dict[res_key]
-            print('Incompatible ' + print_res_type(res.normalization) + 'bounds on ' + res.name)
-            return
+    return res_types.get(parse(normalization), '')
 
-    delta = 0.1**9
+def pulp_expression(expression, lp_var):
+    'Return the LinearExpression expression in terms of the PuLP variables lp_var'
+    return LpAffineExpression([(lp_var[name], coef) for name, coef in expression.coefs.items()])
 
-    if sum(restriction_bounds['umf_'+ox][0] for ox in recipe_fluxes) > 1 + delta:
-        print('Sum of UMF flux lower bounds > 1')
-        return
-        
-    if sum(restriction_bounds['umf_'+ox][1] for ox in recipe_fluxes) < 1 - delta:
-        print('Sum of UMF flux upper bounds < 1')
-        return
+# SECTION 2
+# Define RecipeModel class
+
+class RecipeModel(lpmatrix.MatrixModel):
+    '''The variables and universal restrictions of the LP problem for a given collection of oxides, ingredients
+       and other restrictions. calc_restrictions doesn't modify the model, so one model can be used by several
+       threads at once. Use copy or derive to get a model that can be changed independently'''
+
+    backends = {'highs': 'calc_bounds', 'simplex': 'calc_bounds_warm', 'pulp': 'calc_bounds_pulp'}
+
+    def __init__(self, oxide_dict=oxide_dict, ingredient_dict=ingredient_dict, other_dict=other_dict, restr_dict=None):
+
+        if restr_dict is None:
+            restr_dict = restriction_dict(oxide_dict, ingredient_dict, other_dict)
+        self.ingredient_dict = ingredient_dict
+        ingredient_compositions = {index: ingredient_dict[index].oxide_comp for index in ingredient_dict}
+        lpmatrix.MatrixModel.__init__(self, oxide_dict, ingredient_compositions, other_dict, restr_dict)
+        self.pools = {}    # process pools, indexed by the number of workers
+        self.cache = None  # a cache.ResultCache, if results are to be cached
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pools'] = {}      # process pools can't be sent to other processes
+        state['cache'] = None    # nor can database connections, and workers don't use the cache
+        return state
+
+    def copy(self):
+        '''Return a copy of the model. The matrices of the base model are never modified, so they're shared'''
+        model = copy.copy(self)
+        model.pools = {}
+        return model
+
+    def derive(self, oxide_dict=None, ingredient_dict=None, other_dict=None):
+        '''Return a new model, with some of the oxides, ingredients or other restrictions replaced. The cache
+           (if any) is shared, since its keys include the data each result depends on'''
+        model = RecipeModel(self.oxide_dict if oxide_dict is None else oxide_dict,
+                            self.ingredient_dict if ingredient_dict is None else ingredient_dict,
+                            self.other_dict if other_dict is None else other_dict)
+        model.cache = self.cache
+        return model
+
+    def pulp_problem(self):
+        '''Set up variables and universal restrictions for the LP problem in PuLP form. Returns the problem and
+           the dictionary lp_var of its variables'''
+
+        prob = pulp.LpProblem('Glaze recipe', pulp.LpMaximize)
+        lp_var = {}     # dictionary for the variables in the linear programming problem prob.
+
+        oxide_dict = self.oxide_dict
+        ingredient_compositions = self.ingredient_compositions
+        other_dict = self.other_dict
+
+        for total in ['ingredient_total', 'fluxes_total', 'ox_mass_total', 'ox_mole_total']:
+            lp_var[total] = pulp.LpVariable(total, 0, None, pulp.LpContinuous)           # used to normalize
+
+        for index in ingredient_compositions:
+            ing = 'ingredient_'+index
+            lp_var[ing] = pulp.LpVariable(ing, 0, None, pulp.LpContinuous)
+            
+        for ox in oxide_dict:
+            lp_var['mole_'+ox] = pulp.LpVariable('mole_'+ox, 0, None, pulp.LpContinuous)
+            lp_var['mass_'+ox] = pulp.LpVariable('mass_'+ox, 0, None, pulp.LpContinuous)
+            prob += lp_var['mole_'+ox]*oxide_dict[ox].molar_mass == lp_var['mass_'+ox]   # relate mole percent and unity
+            prob += sum(ingredient_compositions[index][ox]*lp_var['ingredient_'+index]/100 \
+                        for index in ingredient_compositions if ox in ingredient_compositions[index]) \
+                    == lp_var['mass_'+ox], ox     # relate ingredients and oxides
+
+        for index in other_dict:
+            ot = 'other_'+index
+            coefs = other_dict[index].numerator.coefs
+            linear_combo = [(lp_var[key], coefs[key]) for key in coefs]
+            lp_var[ot] = pulp.LpVariable(ot, 0, None, pulp.LpContinuous)
+            prob += lp_var[ot] == LpAffineExpression(linear_combo)         # relate this variable to the other variables.
+
+        prob += lp_var['ingredient_total'] == sum(lp_var['ingredient_'+index] for index in ingredient_compositions), 'ing_total'
+        prob += lp_var['fluxes_total'] == sum(oxide_dict[ox].flux*lp_var['mole_'+ox] for ox in oxide_dict)
+        prob += lp_var['ox_mass_total'] == sum(lp_var['mass_'+ox] for ox in oxide_dict)
+        prob += lp_var['ox_mole_total'] == sum(lp_var['mole_'+ox] for ox in oxide_dict)
+
+        return prob, lp_var
+
+    def check_restrictions(self, restriction_bounds, recipe_ingredients, recipe_oxides):
+        '''Test for obvious errors in the bounds. Returns a message describing the first error found,
+           or None if there isn't one'''
+
+        oxide_dict = self.oxide_dict
+        recipe_fluxes = [ox for ox in recipe_oxides if oxide_dict[ox].flux == 1]
+
+        if sum(oxide_dict[ox].flux for ox in recipe_oxides) == 0:
+            return 'No flux! You have to give a flux.'
+
+        for res_key, bounds in restriction_bounds.items():
+            if bounds[0] > bounds[1]:
+                res = self.restr_dict[res_key]
+                return 'Incompatible ' + print_res_type(res.normalization) + 'bounds on ' + res.name
+
+        delta = 0.1**9
+
+        if sum(restriction_bounds['umf_'+ox][0] for ox in recipe_fluxes) > 1 + delta:
+            return 'Sum of UMF flux lower bounds > 1'
+            
+        if sum(restriction_bounds['umf_'+ox][1] for ox in recipe_fluxes) < 1 - delta:
+            return 'Sum of UMF flux upper bounds < 1'
+
+        for t in ['mass_perc_', 'mole_perc_']:
+            if sum(restriction_bounds[t+ox][0] for ox in recipe_oxides) > 100 + delta:
+                return 'Sum of ' + t + 'lower bounds > 100'
+
+            if sum(restriction_bounds[t+ox][1] for ox in recipe_oxides) < 100 - delta:
+                return 'Sum of ' + t + 'upper bounds < 100'
+            
+        sum_ing_low = sum(restriction_bounds['ingredient_'+index][0] for index in recipe_ingredients)
+        if sum_ing_low > 100 + delta:
+            return ('The sum of the ingredient lower bounds is '+str(sum_ing_low)
+                    +'. Decrease one of the lower bounds by at least '+str(sum_ing_low-100))     #will be a problem if they're all < sum_ing_low-100
+
+        sum_ing_upp = sum(restriction_bounds['ingredient_'+index][1] for index in recipe_ingredients)
+        if sum_ing_upp < 100 - delta:
+            return ('The sum of the ingredient upper bounds is only '+str(sum_ing_upp)
+                    +'. Increase one of the upper bounds by at least '+str(100-sum_ing_upp))
+
+    def recipe_oxides(self, recipe_ingredients):
+        'Return the set of oxides in the ingredients of the recipe'
+        recipe_oxides = set()
+        for index in recipe_ingredients:
+            recipe_oxides = recipe_oxides.union(set(self.ingredient_compositions[index]))  # Is there a more efficient way to do this?
+        return recipe_oxides.intersection(self.oxide_dict)      # ingredient compositions may also record LOI, cost, etc
+
+    def calc_restrictions(self, restriction_bounds, recipe_ingredients, recipe_other, backend='simplex', workers=1, **options):
+        ''' restriction bounds must be a dictionary with keys of the form
+            'umf_'+ox, 'mass_perc_'+ox, 'mole_perc_'+ox, where ox is in recipe_oxides (defined below),
+            'ingredient_'+index, where index is in recipe_ingredients
+            or 'other_'+index, where index is in recipe_other.
+            The values of restriction_bounds are of the form [low,upp], where low and upp are,
+            respectively, the user-defined lower and upper bounds for that restriction.
+            recipe_ingredients and recipe_other are lists of indices representing the ingredients
+            and other restrictions used in the recipe.
+            backend is one of the keys of RecipeModel.backends: 'simplex' (the default) solves the problems
+            in-process, warm-starting each solve from the previous optimal basis, and handing any solve it
+            fails on to HiGHS, 'highs' solves each problem from scratch with HiGHS, through scipy's linprog,
+            and 'pulp' is the original PuLP + GLPK implementation.
+            If workers > 1, the problems are shared out among that many worker processes.
+            If the model has a cache, results are looked up there first, and stored there.
+            The other options are passed on to the backend:
+              stats: a dictionary, to which the numbers of solves (and for 'simplex', pivots etc) are added.
+              presolve: unless False, the 'highs' and 'simplex' backends solve the reduced problem returned
+                by reduced_problem, whose size depends only on the recipe.
+              harvest: unless False, the 'highs' and 'simplex' backends use each optimal point to settle
+                the bounds it determines, without solving for them (see lpmatrix.Harvest)
+              report: an instrumentation.SolveReport, in which each solve is recorded (see calc_report).
+            If the calculation fails, the reason is printed, and None is returned'''
+
+        calc_bounds, error = self.calc_result(restriction_bounds, recipe_ingredients, recipe_other, backend, workers,
+                                              **options)
+        if error is not None:
+            print(error)
+        return calc_bounds
+
+    def calc_result(self, restriction_bounds, recipe_ingredients, recipe_other, backend='simplex', workers=1, **options):
+        '''Calculate the restrictions as calc_restrictions does, but return a pair (calc_bounds, error) instead of
+           printing the reason for a failure: error is None if the calculation succeeded, and otherwise it's the
+           message describing why it failed (the first error found in the bounds, or the status of the solve
+           that failed), and calc_bounds is None'''
+
+        recipe_oxides = self.recipe_oxides(recipe_ingredients)
+         
+    # First, test for obvious errors
+
+        error = self.check_restrictions(restriction_bounds, recipe_ingredients, recipe_oxides)
+        if error is not None:
+            return None, error
+
+        if self.cache is not None:
+            key = self.cache.key(self, restriction_bounds, recipe_ingredients, recipe_other, backend)
+            calc_bounds = self.cache.get(key, restriction_bounds)
+            if calc_bounds is not None:
+                return calc_bounds, None
+
+        errors = []
+        if workers > 1:
+            calc_bounds = self.calc_parallel(backend, workers, restriction_bounds, recipe_ingredients, recipe_oxides,
+                                             recipe_other, errors=errors, **options)
+        else:
+            calc = getattr(self, self.backends[backend])
+            calc_bounds = calc(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, errors=errors, **options)
+
+        if self.cache is not None:
+            self.cache.put(key, calc_bounds)
+        if calc_bounds is None:
+            return None, errors[0] if errors else 'No solution'
+        return calc_bounds, None
+
+    def calc_report(self, restriction_bounds, recipe_ingredients, recipe_other, backend='simplex', hooks=(), trace=None,
+                    trace_path='constraints.lp', bound_hooks=(), **options):
+        '''Calculate the restrictions as calc_restrictions does (in this process, without the cache), and return the
+           calculated bounds (or None, if the calculation fails) together with an instrumentation.SolveReport, which
+           records the timings, status and iterations of each solve, the backend's statistics and the reason for a
+           failure. hooks, trace, trace_path and bound_hooks are passed to the SolveReport: each hook is called after
+           each solve, each bound hook as soon as a bound is known, and trace says which LP files to write'''
+
+        report = instrumentation.SolveReport(hooks, trace, trace_path, bound_hooks)
+        recipe_oxides = self.recipe_oxides(recipe_ingredients)
+        report.error = self.check_restrictions(restriction_bounds, recipe_ingredients, recipe_oxides)
+        if report.error is not None:
+            return None, report
+
+        errors = []
+        calc = getattr(self, self.backends[backend])
+        calc_bounds = calc(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, stats=report.counters,
+                           errors=errors, report=report, **options)
+        if calc_bounds is None:
+            report.error = errors[0] if errors else 'No solution'
+        return calc_bounds, report
+
+    def calc_state(self, restriction_bounds, recipe_ingredients, recipe_other, backend='simplex', **options):
+        '''Calculate the restrictions as calc_restrictions does (in this process, without the cache), but return
+           an lpmatrix.BoundsState, from which recalc_restrictions can update the result when a bound is changed.
+           The calculated bounds are in its calc_bounds attribute. Returns None if the calculation fails'''
+
+        recipe_oxides = self.recipe_oxides(recipe_ingredients)
+        error = self.check_restrictions(restriction_bounds, recipe_ingredients, recipe_oxides)
+        if error is not None:
+            print(error)
+            return
 
-    for t in ['mass_perc_', 'mole_perc_']:
-        if sum(restriction_bounds[t+ox][0] for ox in recipe_oxides) > 100 + delta:
-            print('Sum of ' + t + 'lower bounds > 100')
+        stats = options.pop('stats', None)
+        state = lpmatrix.BoundsState(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, backend, options)
+        calc = getattr(self, self.backends[backend])
+        state.calc_bounds = calc(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, stats=stats,
+                                 points=state.points, **options)
+        if state.calc_bounds is not None:
+            return state
+
+    def recalc_restrictions(self, state, key, bounds, stats=None):
+        '''Change the bounds on restriction key to bounds, updating state and returning the new calculated bounds.
+           Only the restrictions for which unchanged_bounds can't show that the recorded optimal points are still
+           optimal are solved again. The 'pulp' backend records no points, so everything is solved again.
+           If the calculation fails, None is returned and state is left as it was.
+           If a dictionary stats is given, the number of restrictions recalculated is added to it, along with
+           the backend's statistics'''
+
+        restriction_bounds = {k: list(b) for k, b in state.restriction_bounds.items()}
+        restriction_bounds[key] = list(bounds)
+        error = self.check_restrictions(restriction_bounds, state.recipe_ingredients, state.recipe_oxides)
+        if error is not None:
+            print(error)
             return
 
-        if sum(restriction_bounds[t+ox][1] for ox in recipe_oxides) < 100 - delta:
-            print('Sum of ' + t + 'upper bounds < 100')
+        unchanged = self.unchanged_bounds(state, key, bounds)
+        keys = [k for k in restriction_bounds if (k, 0) not in unchanged or (k, 1) not in unchanged]
+        if keys:
+            points = {}
+            calc = getattr(self, self.backends[state.backend])
+            calc_bounds = calc(restriction_bounds, state.recipe_ingredients, state.recipe_oxides, state.recipe_other,
+                               keys=keys, stats=stats, points=points, **state.options)
+            if calc_bounds is None:
+                return
+            for k in keys:
+                state.calc_bounds[k] = calc_bounds[k]
+                for i in [0,1]:
+                    state.points.pop((k, i), None)
+            state.points.update(points)
+        state.restriction_bounds = restriction_bounds
+        lpmatrix.add_stats(stats, recalculated=len(keys))
+        return {k: list(b) for k, b in state.calc_bounds.items()}
+
+    def sweep_restrictions(self, restriction_bounds, recipe_ingredients, recipe_other, key, i, values, stats=None,
+                           presolve=True, errors=None):
+        '''Generator yielding the calculated bounds as bound i (0 for the lower bound, 1 for the upper bound)
+           of restriction key takes each of the given values in turn, with the other bounds as in
+           restriction_bounds. The problem is set up once, and the optimal points and bases of each step
+           are reused in the next (see lpmatrix.Sweep), so it's much faster than calling calc_restrictions
+           for each value. None is yielded for values where the calculation fails, and the reason is printed,
+           or appended to the list errors if one is given'''
+
+        recipe_oxides = self.recipe_oxides(recipe_ingredients)
+        values = list(values)
+        sweep = lpmatrix.Sweep(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, key, i, values,
+                               presolve)
+        bounds = {k: list(b) for k, b in restriction_bounds.items()}
+        for value in values:
+            bounds[key][i] = value
+            error = self.check_restrictions(bounds, recipe_ingredients, recipe_oxides)
+            if error is not None:
+                lpmatrix.report_error(error, errors)
+                yield
+            else:
+                yield sweep.step(value, stats, errors)
+
+    def calc_2d_projection(self, restriction_bounds, recipe_ingredients, recipe_other, x_key, y_key, tol=None, stats=None,
+                           presolve=True, errors=None):
+        '''Return the list of vertices (x, y), in anticlockwise order, of the projection of the set of recipes satisfying
+           restriction_bounds onto the restrictions x_key and y_key, or None if there are no such recipes. When the two
+           restrictions have the same normalization, the polygon is exact, and takes about two solves per edge. Otherwise
+           the boundary can be curved, and the vertices approximate it to within tol (relative to the size of the region).
+           A larger tol gives fewer vertices and solves. If tol is None, a default suited to each case is used.
+           The reason for a failure is printed, or appended to the list errors if one is given.
+           See lpmatrix.MatrixModel.calc_projection'''
+
+        recipe_oxides = self.recipe_oxides(recipe_ingredients)
+        error = self.check_restrictions(restriction_bounds, recipe_ingredients, recipe_oxides)
+        if error is not None:
+            lpmatrix.report_error(error, errors)
             return
-        
-    sum_ing_low = sum(restriction_bounds['ingredient_'+index][0] for index in recipe_ingredients)
-    if sum_ing_low > 100 + delta:
-        print('The sum of the ingredient lower bounds is '+str(sum_ing_low)
-              +'. Decrease one of the lower bounds by at least '+str(sum_ing_low-100))     #will be a problem if they're all < sum_ing_low-100
-        return
-
-    sum_ing_upp = sum(restriction_bounds['ingredient_'+index][1] for index in recipe_ingredients)
-    if sum_ing_upp < 100 - delta:
-        print('The sum of the ingredient upper bounds is only '+str(sum_ing_upp)
-              +'. Increase one of the upper bounds by at least '+str(100-sum_ing_upp))
-        return
-
-# Set user-imposed bounds
-
-    for index in ingredient_dict:
-        ing = 'ingredient_'+index
-        if index in recipe_ingredients:
-            ing_low = 0.01*restriction_bounds[ing][0]
-            ing_upp = 0.01*restriction_bounds[ing][1]
-        else:
-            ing_low = 0
-            ing_upp = 0
-        prob.constraints[ing+'_lower'] = lp_var[ing] >= ing_low*lp_var['ingredient_total']      # ingredient lower bounds    
-        prob.constraints[ing+'_upper'] = lp_var[ing] <= ing_upp*lp_var['ingredient_total']      # ingredient upper bounds
-     
-    for ox in oxide_dict:          
-        if ox in recipe_oxides:     
+        return self.calc_projection(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, x_key, y_key,
+                                    tol, stats, presolve, errors)
+
+    def sample_recipes(self, restriction_bounds, recipe_ingredients, recipe_other, n=1000, seed=None, stream=False,
+                       block_size=1000, **options):
+        '''Return the analysis of n random recipes satisfying restriction_bounds, drawn (approximately) uniformly from
+           the region by hit-and-run, as a dictionary of arrays with one row per recipe: 'ingredient' (the percentages
+           of recipe_ingredients), 'umf', 'mass_perc', 'mole_perc' and 'other'. The same seed gives the same recipes.
+           If stream is True, return a generator yielding the analysis of block_size recipes at a time, indefinitely,
+           instead. The options (chains, burn, thin) are passed to sampler.RecipeSampler. If there are no such
+           recipes, the reason is printed, and None is returned'''
+
+        recipe_oxides = self.recipe_oxides(recipe_ingredients)
+        error = self.check_restrictions(restriction_bounds, recipe_ingredients, recipe_oxides)
+        if error is None:
+            recipe_sampler, error = sampler.recipe_sampler(self, restriction_bounds, recipe_ingredients, recipe_oxides,
+                                                           recipe_other, seed, **options)
+        if error is not None:
+            print(error)
+            return
+        if stream:
+            return recipe_sampler.stream(block_size)
+        return recipe_sampler.sample(n)
+
+    def calc_bounds_pulp(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, keys=None, stats=None,
+                         errors=None, report=None, **options):
+        '''The reference backend: solve each problem with GLPK, via PuLP. The PuLP problem is set up afresh for
+           each call, since PuLP stores solutions in the variables. Options for the other backends are ignored.
+           If report is given, PuLP writes the LP files it asks for (see instrumentation.SolveReport)'''
+
+        start = time.perf_counter()
+        prob, lp_var = self.pulp_problem()
+
+    # Set user-imposed bounds
+
+        for index in self.ingredient_compositions:
+            ing = 'ingredient_'+index
+            if index in recipe_ingredients:
+                ing_low = 0.01*restriction_bounds[ing][0]
+                ing_upp = 0.01*restriction_bounds[ing][1]
+            else:
+                ing_low = 0
+                ing_upp = 0
+            prob.constraints[ing+'_lower'] = lp_var[ing] >= ing_low*lp_var['ingredient_total']      # ingredient lower bounds    
+            prob.constraints[ing+'_upper'] = lp_var[ing] <= ing_upp*lp_var['ingredient_total']      # ingredient upper bounds
+         
+        for ox in recipe_oxides:
             prob.constraints[ox+'_umf_lower'] = lp_var['mole_'+ox] >= restriction_bounds['umf_'+ox][0]*lp_var['fluxes_total']   # oxide UMF lower bounds
             prob.constraints[ox+'_umf_upper'] = lp_var['mole_'+ox] <= restriction_bounds['umf_'+ox][1]*lp_var['fluxes_total']   # oxide UMF upper bounds
             prob.constraints[ox+'_wt_%_lower'] = lp_var['mass_'+ox] >= 0.01*restriction_bounds['mass_perc_'+ox][0]*lp_var['ox_mass_total']    # oxide weight % lower bounds
@@ -153,89 +403,215 @@ def calc_restrictions(restriction_bounds, recipe_ingredients, recipe_other):
             prob.constraints[ox+'_mol_%_lower'] = lp_var['mole_'+ox] >= 0.01*restriction_bounds['mole_perc_'+ox][0]*lp_var['ox_mole_total']   # oxide mol % lower bounds
             prob.constraints[ox+'_mol_%_upper'] = lp_var['mole_'+ox] <= 0.01*restriction_bounds['mole_perc_'+ox][1]*lp_var['ox_mole_total']   # oxide mol % upper bounds
 
-        else:
-            try:
-                del prob.constraints[ox+'_umf_lower']
-                del prob.constraints[ox+'_umf_upper']
-                del prob.constraints[ox+'_wt_%_lower']
-                del prob.constraints[ox+'_wt_%_upper']
-                del prob.constraints[ox+'_mol_%_lower']
-                del prob.constraints[ox+'_mol_%_upper']
-            except:
-                pass
-
-    for index in other_dict:
-        if index in recipe_other:  
-            other_norm = eval(other_dict[index].normalization)               
+        for index in recipe_other:
+            other_norm = pulp_expression(self.other_dict[index].normalization, lp_var)
             prob.constraints['other_'+index+'_lower'] = lp_var['other_'+index] >= restriction_bounds['other_'+index][0]*other_norm   # lower bound
             prob.constraints['other_'+index+'_upper'] = lp_var['other_'+index] <= restriction_bounds['other_'+index][1]*other_norm   # upper bound
-        else:
+
+    # The 'highs' and 'simplex' backends run a pre-solver at this point (see lpmatrix.MatrixModel.reduced_problem)
+
+    # Calculate the upper and lower bounds imposed on all the variables:
+
+        if report is not None:
+            report.setup_time += time.perf_counter() - start
+
+        calc_bounds = {}  # Will be of the same form as restriction_bounds     
+        for key in (restriction_bounds if keys is None else keys):
+            start = time.perf_counter()
+            calc_bounds[key] = list([0,0])       # set up the list that will contain the calculated lower and upper bounds
+            res = self.restr_dict[key]
+            prob.constraints['normalization'] = pulp_expression(res.normalization, lp_var) == 1  # Apply the normalization of the restriction in question
+                                                                              # Apparently this doesn't slow things down a whole lot
+            for sign in [1,-1]:               # calculate lower and upper bounds.
+                i = int((sign+1)/2)           # 1 -> 1 (upper), -1 -> 0 (lower)
+                prob += sign*lp_var[res.objective_func], res.name
+                if report is not None and report.tracing(key):
+                    prob.writeLP(report.trace_file(key, i))     # LP files used to be written before every solve
+                solve_start = time.perf_counter()
+                prob.solve(solver)
+                solve_end = time.perf_counter()
+                lpmatrix.add_stats(stats, solves=1)
+                if prob.status == 1:
+                    calc_bounds[key][i] = abs(sign*pulp.value(prob.objective))  # we use abs above to avoid showing -0.0, but this could cause
+                                                                                # problems if we introduce other attributes that can be negative
+                status = LpStatus.get(prob.status, 'No solution. Problem status '+str(prob.status))
+                if report is not None:
+                    report.record(key, i, 'pulp', status, None, solve_start - start, solve_end - solve_start,
+                                  time.perf_counter() - solve_end)
+                    if prob.status == 1:
+                        report.settle(key, i, calc_bounds[key][i])
+                    if prob.status != 1 and report.trace is not None:
+                        prob.writeLP(report.trace_file())
+                if prob.status != 1:
+                    lpmatrix.report_error(status, errors)
+                    return
+                start = time.perf_counter()
+
+        return calc_bounds
+
+    def calc_parallel(self, backend, workers, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other,
+                      stats=None, errors=None, **options):
+        '''Split the keys of restriction_bounds into one contiguous share per worker, and merge the results
+           in the order of restriction_bounds. Keys with the same normalization are kept together where
+           possible, so the warm-started backend still benefits from its previous basis.
+           Each worker process receives its own copy of the model when it starts, and the pool is kept
+           alive between calls, since starting the processes takes much longer than solving the problems'''
+
+        if workers not in self.pools:
+            self.pools[workers] = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self,))
+        order = sorted(restriction_bounds, key=lambda key: self.restr_dict[key].normalization)
+        shares = [order[w*len(order)//workers:(w+1)*len(order)//workers] for w in range(workers)]
+        futures = [self.pools[workers].submit(calc_worker, backend, restriction_bounds, recipe_ingredients, recipe_oxides,
+                                              recipe_other, keys, options) for keys in shares if keys]
+        results = [future.result() for future in futures]
+        for calc_bounds, worker_stats, worker_errors in results:
+            lpmatrix.add_stats(stats, **worker_stats)
+        for calc_bounds, worker_stats, worker_errors in results:
+            if calc_bounds is None:
+                lpmatrix.report_error(worker_errors[0] if worker_errors else 'No solution', errors)
+                return
+        merged = {}
+        for calc_bounds, worker_stats, worker_errors in results:
+            merged.update(calc_bounds)
+        return {key: merged[key] for key in restriction_bounds}
+
+    def calc_restrictions_batch(self, jobs, backend='simplex', workers=1, chunk_size=100, stats=None, **options):
+        '''Generator calculating the restrictions for each job (restriction_bounds, recipe_ingredients, recipe_other)
+           of the iterable jobs, and yielding, in the order of jobs, a dictionary with entries
+             'index': the position of the job in jobs,
+             'calc_bounds': the calculated bounds, as returned by calc_restrictions, or None if the calculation failed,
+             'error': None, or the reason the calculation failed (see calc_result).
+           Nothing is printed. jobs is read chunk_size jobs at a time, and the jobs in a chunk with the same set
+           of ingredients are calculated together by calc_group. If workers > 1, these groups are shared out among
+           that many worker processes, and the next chunk is started before the results of the last one are
+           yielded. At most two chunks are held at once, so jobs can be a stream of any length. The cache, if any,
+           is used as in calc_restrictions. If a dictionary stats is given, the statistics of all the jobs are
+           added to it. The other options are passed on to the backend'''
+
+        jobs = iter(jobs)
+        model = self.copy()      # calc_group sets rows_memo, so it can't be used on a model shared with other threads
+        model.cache = None       # the cache is looked up in start_chunk instead
+        if workers > 1 and workers not in self.pools:
+            self.pools[workers] = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self,))
+        depth = 2 if workers > 1 else 1
+        chunks = deque()         # the chunks in progress
+        start = 0
+        while True:
+            chunk = list(islice(jobs, chunk_size))
+            if chunk:
+                chunks.append(self.start_chunk(model, backend, workers, chunk, start, options))
+                start += len(chunk)
+            if not chunks:
+                return
+            if chunk and len(chunks) < depth:
+                continue
+            results, groups, keys = chunks.popleft()
+            for group in groups:
+                group_results, group_stats = group.result() if workers > 1 else group
+                lpmatrix.add_stats(stats, **group_stats)
+                results += group_results
+            for result in sorted(results, key=lambda result: result['index']):
+                if result['index'] in keys:
+                    self.cache.put(keys[result['index']], result['calc_bounds'])
+                yield result
+
+    def start_chunk(self, model, backend, workers, chunk, start, options):
+        '''Start calculating a chunk of the jobs of calc_restrictions_batch, whose first job is job number start.
+           Returns the results found in the cache, the groups of jobs being calculated (as futures, if workers > 1)
+           and the cache keys of the jobs that weren't found'''
+
+        results, groups, keys = [], {}, {}
+        for index, (restriction_bounds, recipe_ingredients, recipe_other) in enumerate(chunk, start):
+            if self.cache is not None:
+                try:
+                    key = self.cache.key(self, restriction_bounds, recipe_ingredients, recipe_other, backend)
+                except (KeyError, TypeError, ValueError, AttributeError, IndexError):   # calc_group reports what's wrong
+                    key = None
+                calc_bounds = None if key is None else self.cache.get(key, restriction_bounds)
+                if calc_bounds is not None:
+                    results.append({'index': index, 'calc_bounds': calc_bounds, 'error': None})
+                    continue
+                if key is not None:
+                    keys[index] = key
             try:
-                del prob.constraints['other_'+index+'_lower']
-                del prob.constraints['other_'+index+'_upper']
-            except:
-                pass
-
-# To do. Figure out a way of running a pre-solver at this point
-
-# Calculate the upper and lower bounds imposed on all the variables:
-
-    calc_bounds = {}  # Will be of the same form as restriction_bounds     
-    for key in restriction_bounds:
-        calc_bounds[key] = list([0,0])       # set up the list that will contain the calculated lower and upper bounds
-        res = restr_dict[key]
-        prob.constraints['normalization'] = eval(res.normalization) == 1  # Apply the normalization of the restriction in question
-                                                                          # Apparently this doesn't slow things down a whole lot
-        for sign in [1,-1]:               # calculate lower and upper bounds.
-            i = int((sign+1)/2)           # 1 -> 1 (upper), -1 -> 0 (lower)
-            prob += sign*lp_var[res.objective_func], res.name
-            prob.writeLP('constraints.lp')
-            prob.solve(solver)
-            if prob.status == 1:
-                calc_bounds[key][i] = abs(sign*pulp.value(prob.objective))  # we use abs above to avoid showing -0.0, but this could cause
-                                                                            # problems if we introduce other attributes that can be negative
-                                                    
-            else:
+                group = groups.setdefault(tuple(sorted(recipe_ingredients)), [])
+            except TypeError:       # the ingredients can't be sorted or hashed, so the job goes in a group of its own
+                group = groups.setdefault(index, [])
+            group.append((index, restriction_bounds, recipe_ingredients, recipe_other))
+        if workers > 1:
+            groups = [self.pools[workers].submit(batch_worker, backend, group, options) for group in groups.values()]
+        else:
+            groups = [model.calc_group(backend, group, options) for group in groups.values()]
+        return results, groups, keys
+
+    def calc_group(self, backend, jobs, options):
+        '''Calculate the jobs (index, restriction_bounds, recipe_ingredients, recipe_other) of a batch, which have the
+           same ingredients, so the coefficient rows of their problems are only worked out once (see
+           lpmatrix.MatrixModel.ingredient_rows). Returns the list of results, as yielded by calc_restrictions_batch,
+           and the dictionary of statistics. A malformed job gets an error starting with 'Invalid job', without
+           affecting the others. Since it sets rows_memo, it's only used on copies of the model'''
+
+        results = []
+        stats = {}
+        self.rows_memo = {}
+        for index, restriction_bounds, recipe_ingredients, recipe_other in jobs:
+            calc_bounds, error = None, check_job(restriction_bounds, recipe_ingredients, recipe_other)
+            if error is None:
                 try:
-                    print(LpStatus[prob.status])
-                except:
-                    print('No solution. Problem status '+prob.status)
-                prob.writeLP('constraints.lp')
-                return
-
-    return calc_bounds
-
-##    def calc_2d_projection(self, prob, lp_var, proj_frame):  # This is designed to be run when only the x and y variables have changed; it does not take
-##                                               # into account changes to upper and lower bounds. It should be possible to detect when the
-##                                               # user has clicked in one of the entry boxes since the last time calc_restrictions was run,
-##                                               # and give a warning in this case. Something like, if you have changed any bounds, click
-##                                               # 'Calculate restrictions' to apply them.
-##         
-##        #Need this for 2d projection
-##        tdp = 1
-##
-##        if len(self.variables) == 2:
-##            x_var = restr_dict[self.variables['x']]
-##            y_var = restr_dict[self.variables['y']]
-##            if x_var.normalization == y_var.normalization:
-##                prob.constraints['normalization'] =  eval(x_var.normalization) == 1
-##                var_x = lp_var[x_var.objective_func]
-##                var_y = lp_var[y_var.objective_func]
-##
-##            else:
-##                messagebox.showwarning(" ", '2-dim projection of restrictions with different normalizations not implemented yet')
-##                tdp = 0
-##        else:
-##            tdp = 0
-##             
-##        if tdp == 1:
-##            vertices = prob.two_dim_projection(var_x, var_y)            # defined in pulp2dim file
-##
-##     # Display 2-d projection of feasible region onto 'x'-'y' axes
-##        if tdp == 1:
-##            canvas = Canvas(proj_frame, width=450, height=450, bg = 'white', borderwidth = 1, relief = 'solid')
-##            canvas.create_polygon_plot(vertices)
-##            canvas.pack(expand='yes', fill='both')
+                    calc_bounds, error = self.calc_result(restriction_bounds, recipe_ingredients, recipe_other, backend,
+                                                          stats=stats, **options)
+                except (KeyError, TypeError, ValueError, AttributeError, IndexError) as e:   # the job itself is malformed
+                    calc_bounds, error = None, 'Invalid job: ' + repr(e)
+            results.append({'index': index, 'calc_bounds': calc_bounds, 'error': error})
+        self.rows_memo = None
+        return results, stats
+
+def check_job(restriction_bounds, recipe_ingredients, recipe_other):
+    '''Return a message saying what's wrong with the form of a job of calc_restrictions_batch, or None if nothing is:
+       restriction_bounds must be a dictionary whose values are pairs of numbers, and recipe_ingredients and
+       recipe_other must be lists. Whether the keys exist is left to the calculation'''
+    if not isinstance(restriction_bounds, dict):
+        return 'Invalid job: restriction_bounds must be a dictionary'
+    for key, bounds in restriction_bounds.items():
+        if not (isinstance(bounds, (list, tuple)) and len(bounds) == 2
+                and all(isinstance(b, numbers.Real) and not isinstance(b, bool) for b in bounds)):
+            return 'Invalid job: the bounds of %r must be a pair of numbers, not %r' % (key, bounds)
+    for name, items in [('recipe_ingredients', recipe_ingredients), ('recipe_other', recipe_other)]:
+        if not isinstance(items, (list, tuple)):
+            return 'Invalid job: %s must be a list' % name
+
+# SECTION 3
+# Worker processes for RecipeModel.calc_parallel and RecipeModel.calc_restrictions_batch
+
+worker_model = None
+
+def init_worker(model):
+    global worker_model
+    worker_model = model
+
+def calc_worker(backend, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, keys, options):
+    stats = {}
+    errors = []
+    calc = getattr(worker_model, worker_model.backends[backend])
+    calc_bounds = calc(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, keys=keys, stats=stats,
+                       errors=errors, **options)
+    return calc_bounds, stats, errors
+
+def batch_worker(backend, jobs, options):
+    return worker_model.calc_group(backend, jobs, options)
+
+# SECTION 4
+# The model for the oxides, ingredients and other restrictions defined in restrictions.py
+
+default_model = RecipeModel(oxide_dict, ingredient_dict, other_dict, restr_dict)
+
+def calc_restrictions(restriction_bounds, recipe_ingredients, recipe_other, backend='simplex', workers=1, **options):
+    'Calculate the restrictions using default_model. See RecipeModel.calc_restrictions'
+    return default_model.calc_restrictions(restriction_bounds, recipe_ingredients, recipe_other, backend, workers, **options)
+
+def calc_restrictions_batch(jobs, backend='simplex', workers=1, chunk_size=100, stats=None, **options):
+    'Calculate the restrictions for a batch of jobs using default_model. See RecipeModel.calc_restrictions_batch'
+    return default_model.calc_restrictions_batch(jobs, backend, workers, chunk_size, stats, **options)
 
 demo_res_bounds = {'umf_SiO2':[3,4],'umf_Al2O3':[0.3,0.5],'umf_CaO':[0,1],
                    'mass_perc_SiO2':[0,100],'mass_perc_Al2O3':[0,100],'mass_perc_CaO':[0,100],
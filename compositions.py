@@ -0,0 +1,124 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# The ingredient compositions as arrays, for analysing many recipes at once. The analysis of a recipe is linear
+# in the amounts of its ingredients, up to the final division by a normalization, so a batch of recipes
+# (one per row of an array) is analysed with a few matrix products.
+
+import numpy as np
+
+from restrictions import *
+import lpmatrix
+
+# SECTION 1
+# Define CompositionMatrix class
+
+class CompositionMatrix:
+    '''The compositions of the ingredients in ingredient_compositions as the matrix comp, whose rows are the
+       ingredients (in the order of the list ingredients) and whose columns are the oxides (in the order of
+       the list oxides), with entries the weight percent of the oxide in the ingredient. molar_mass and flux
+       are the vectors of the molar masses of the oxides and the flux mask. The numerators and denominators
+       of the other restrictions are also stored as matrices, whose columns are the coefficient vectors in
+       terms of the amounts of the ingredients'''
+
+    def __init__(self, oxide_dict=oxide_dict, ingredient_compositions=ingredient_compositions, other_dict=other_dict):
+
+        self.oxides = list(oxide_dict)
+        self.ingredients = list(ingredient_compositions)
+        self.other = list(other_dict)
+        self.oxide_index = {ox: j for j, ox in enumerate(self.oxides)}
+        self.ingredient_index = {index: j for j, index in enumerate(self.ingredients)}
+
+        self.comp = np.zeros((len(self.ingredients), len(self.oxides)))
+        for i, index in enumerate(self.ingredients):
+            for ox, value in ingredient_compositions[index].items():
+                if ox in self.oxide_index:       # ingredient compositions may also record LOI, cost, etc
+                    self.comp[i, self.oxide_index[ox]] = value
+        self.molar_mass = np.array([oxide_dict[ox].molar_mass for ox in self.oxides], dtype=float)
+        self.flux = np.array([oxide_dict[ox].flux == 1 for ox in self.oxides])
+
+        rows = self.variable_rows()
+        self.numerators = np.zeros((len(self.ingredients), len(self.other)))
+        self.denominators = np.zeros((len(self.ingredients), len(self.other)))
+        for j, index in enumerate(self.other):
+            ot = other_dict[index]
+            self.numerators[:, j] = ot.numerator.vector(rows)
+            self.denominators[:, j] = ot.normalization.vector(rows)
+
+    def variable_rows(self):
+        'Return the Rows expressing each variable of the LP problem in terms of the amounts of the ingredients'
+        n = len(self.ingredients)
+        rows = lpmatrix.Rows(n)
+        rows['ingredient_total'] = np.ones(n)
+        for j, index in enumerate(self.ingredients):
+            rows['ingredient_'+index] = np.eye(1, n, j)[0]
+        mass = self.comp/100
+        mole = mass/self.molar_mass
+        for k, ox in enumerate(self.oxides):
+            rows['mass_'+ox] = mass[:, k]
+            rows['mole_'+ox] = mole[:, k]
+        rows['fluxes_total'] = mole[:, self.flux].sum(axis=1)
+        rows['ox_mass_total'] = mass.sum(axis=1)
+        rows['ox_mole_total'] = mole.sum(axis=1)
+        return rows
+
+    def columns(self, ingredients):
+        'Return the array of the positions of the given ingredients in self.ingredients'
+        return np.array([self.ingredient_index[index] for index in ingredients], dtype=int)
+
+    def analyze_recipes(self, weights, ingredients=None):
+        '''weights is an array with one recipe per row, giving the amounts of the ingredients in self.ingredients,
+           or in the list ingredients, if given. Returns a dictionary of arrays with one row per recipe:
+             'ingredient': the ingredient percentages (columns as in weights)
+             'umf', 'mass_perc', 'mole_perc': the oxide analysis (columns as in self.oxides)
+             'other': the values of the other restrictions (columns as in self.other)
+           Where a normalization is zero (for example, the UMF of a recipe without fluxes), the values are nan or inf'''
+
+        weights = np.atleast_2d(np.asarray(weights, dtype=float))
+        rows = slice(None) if ingredients is None else self.columns(ingredients)
+        comp = self.comp[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mass = weights @ comp/100
+            mole = mass/self.molar_mass
+            return {'ingredient': 100*weights/weights.sum(axis=1, keepdims=True),
+                    'umf': mole/mole[:, self.flux].sum(axis=1, keepdims=True),
+                    'mass_perc': 100*mass/mass.sum(axis=1, keepdims=True),
+                    'mole_perc': 100*mole/mole.sum(axis=1, keepdims=True),
+                    'other': (weights @ self.numerators[rows])/(weights @ self.denominators[rows])}
+
+    def restriction_values(self, analysis, ingredients=None):
+        '''Return a dictionary whose keys are the restriction keys ('umf_SiO2', 'ingredient_3', 'other_0', etc),
+           and whose values are the corresponding columns of analysis, as returned by analyze_recipes'''
+        values = {}
+        for j, index in enumerate(self.ingredients if ingredients is None else ingredients):
+            values['ingredient_'+index] = analysis['ingredient'][:, j]
+        for name in ['umf', 'mass_perc', 'mole_perc']:
+            for j, ox in enumerate(self.oxides):
+                values[name+'_'+ox] = analysis[name][:, j]
+        for j, index in enumerate(self.other):
+            values['other_'+index] = analysis['other'][:, j]
+        return values
+
+# SECTION 2
+# The compositions of the ingredients defined in restrictions.py
+
+default_compositions = CompositionMatrix(oxide_dict, ingredient_compositions, other_dict)
+
+def analyze_recipes(weights, ingredients=None):
+    'Analyse the recipes in the rows of weights using default_compositions. See CompositionMatrix.analyze_recipes'
+    return default_compositions.analyze_recipes(weights, ingredients)
@@ -0,0 +1,103 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# Linear combinations of the variables of the LP problem, such as the normalizations of the restrictions and
+# the numerators of the other restrictions. Normalizations used to be strings like "0.01*lp_var['ox_mass_total']",
+# which were evaluated every time they were used. They're now compiled once into LinearExpression objects, which
+# store only the nonzero coefficients, give their coefficient vectors directly, and can also be written as
+# dictionaries {variable name: coefficient}.
+
+import numpy as np
+
+class LinearExpression:
+    '''The linear combination of the variables of the LP problem with coefficients coefs, a dictionary
+       {variable name: coefficient}. Expressions can be added, subtracted and multiplied by numbers, and are
+       hashable, so they can be compared and used as dictionary keys. repr gives the string form
+       "0.01*lp_var['ox_mass_total']", which parse turns back into the expression'''
+
+    def __init__(self, coefs):
+        self.coefs = {name: float(coef) for name, coef in coefs.items() if coef != 0}
+        self.key = tuple(sorted(self.coefs.items()))
+
+    def __add__(self, other):
+        coefs = dict(self.coefs)
+        for name, coef in parse(other).coefs.items():
+            coefs[name] = coefs.get(name, 0) + coef
+        return LinearExpression(coefs)
+
+    __radd__ = __add__
+
+    def __mul__(self, number):
+        return LinearExpression({name: number*coef for name, coef in self.coefs.items()})
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return -1*self
+
+    def __sub__(self, other):
+        return self + -parse(other)
+
+    def __rsub__(self, other):
+        return parse(other) - self
+
+    def __truediv__(self, number):
+        return (1/number)*self
+
+    def __eq__(self, other):
+        return isinstance(other, LinearExpression) and self.key == other.key
+
+    def __lt__(self, other):        # so that restrictions can be sorted by normalization
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        terms = [('' if coef == 1 else repr(coef)+'*') + 'lp_var[' + repr(name) + ']' for name, coef in self.coefs.items()]
+        return ' + '.join(terms) if terms else '0'
+
+    def vector(self, rows):
+        '''Return the coefficient vector of the expression, where rows[name] is the coefficient vector of the
+           variable name, and rows is a Rows object (for example, expressing the variables in terms of the
+           amounts of the ingredients)'''
+        return sum((coef*rows[name] for name, coef in self.coefs.items()), np.zeros(rows.n))
+
+class Variables:
+    'Used to compile expression strings: Variables()[name] is the expression consisting of the variable name'
+
+    def __getitem__(self, name):
+        return LinearExpression({name: 1})
+
+compiled = {}       # expression strings that have been compiled
+
+def parse(expression):
+    '''Return the LinearExpression given by expression, which may be a LinearExpression, a dictionary
+       {variable name: coefficient}, a number (only 0 makes sense) or a string in terms of lp_var,
+       like "0.01*lp_var['ox_mass_total']". Strings are only evaluated the first time they're seen'''
+    if isinstance(expression, LinearExpression):
+        return expression
+    if isinstance(expression, dict):
+        return LinearExpression(expression)
+    if isinstance(expression, str):
+        if expression not in compiled:
+            compiled[expression] = parse(eval(expression, {'__builtins__': {}}, {'lp_var': Variables()}))
+        return compiled[expression]
+    if expression == 0:
+        return LinearExpression({})
+    raise TypeError('Not a linear expression: ' + repr(expression))
@@ -0,0 +1,188 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# An ingredient library stored in an SQLite database, for libraries too large to load at once. The compositions are
+# stored one oxide per row, indexed by ingredient and by oxide, so that an ingredient can be found by its index or
+# name, and the ingredients containing a given oxide can be listed, without reading the rest of the library.
+# The ingredients are presented as lazy mappings, which only read an ingredient when it's looked up, and
+# recipe_model builds a model from just the ingredients of a recipe, so the time and memory a calculation takes
+# don't depend on the size of the library.
+
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from restrictions import *
+import calculations
+
+class IngredientStore:
+    '''The ingredients in the SQLite database at path (which is created if it doesn't exist), with indices and
+       names as in ingredient_dict. ingredients and compositions are lazy mappings from the indices to the
+       Ingredient objects and to their compositions, like ingredient_dict and ingredient_compositions in
+       restrictions.py; the size most recently used ingredients are kept in memory'''
+
+    def __init__(self, path, size=1000):
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('CREATE TABLE IF NOT EXISTS ingredients (idx TEXT PRIMARY KEY, name TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS ingredient_names ON ingredients (name)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS compositions (idx TEXT, oxide TEXT, value REAL, PRIMARY KEY (idx, oxide))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS composition_oxides ON compositions (oxide, value)')
+        self.db.commit()
+        self.ingredients = LazyIngredients(self, size)
+        self.compositions = LazyCompositions(self.ingredients)
+
+    def add(self, ingredient_dict):
+        'Add the ingredients in the dictionary ingredient_dict {index: Ingredient}, replacing any with the same indices'
+        with self.lock:
+            for index, ingredient in ingredient_dict.items():
+                self.db.execute('DELETE FROM compositions WHERE idx = ?', (index,))
+                self.db.execute('INSERT OR REPLACE INTO ingredients VALUES (?, ?)', (index, ingredient.name))
+                self.db.executemany('INSERT INTO compositions VALUES (?, ?, ?)',
+                                    [(index, ox, value) for ox, value in ingredient.oxide_comp.items()])
+            self.db.commit()
+        self.ingredients.forget(ingredient_dict)
+
+    def remove(self, indices):
+        'Remove the ingredients with the given indices'
+        with self.lock:
+            for index in indices:
+                self.db.execute('DELETE FROM compositions WHERE idx = ?', (index,))
+                self.db.execute('DELETE FROM ingredients WHERE idx = ?', (index,))
+            self.db.commit()
+        self.ingredients.forget(indices)
+
+    def load(self, indices):
+        '''Return the dictionary {index: Ingredient} of the ingredients with the given indices, read with one query
+           for every few hundred ingredients. Raises KeyError if one of them isn't in the store'''
+        indices = list(dict.fromkeys(indices))
+        names, comps = {}, {}
+        with self.lock:
+            for start in range(0, len(indices), 500):       # SQLite limits the number of parameters of a query
+                chunk = indices[start:start+500]
+                marks = ','.join('?'*len(chunk))
+                for index, name in self.db.execute('SELECT idx, name FROM ingredients WHERE idx IN (%s)' % marks, chunk):
+                    names[index] = name
+                    comps[index] = {}
+                for index, ox, value in self.db.execute('SELECT idx, oxide, value FROM compositions WHERE idx IN (%s)'
+                                                        % marks, chunk):
+                    comps[index][ox] = value
+        for index in indices:
+            if index not in names:
+                raise KeyError(index)
+        return {index: Ingredient(names[index], comps[index]) for index in indices}
+
+    def index_of(self, name):
+        'Return the index of the ingredient called name. Raises KeyError if there is none'
+        with self.lock:
+            row = self.db.execute('SELECT idx FROM ingredients WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0]
+
+    def search(self, pattern):
+        'Return the list of (index, name) of the ingredients whose names match the SQL LIKE pattern, e.g. "Frit%"'
+        with self.lock:
+            return self.db.execute('SELECT idx, name FROM ingredients WHERE name LIKE ? ORDER BY name', (pattern,)).fetchall()
+
+    def containing(self, oxide, min_value=0):
+        'Return the list of the indices of the ingredients containing more than min_value percent of oxide'
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT idx FROM compositions WHERE oxide = ? AND value > ?',
+                                                      (oxide, min_value))]
+
+    def indices(self):
+        'Return the list of the indices of all the ingredients, in the order they were added'
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT idx FROM ingredients ORDER BY rowid')]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM ingredients').fetchone()[0]
+
+    def __contains__(self, index):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM ingredients WHERE idx = ?', (index,)).fetchone() is not None
+
+    def recipe_model(self, recipe_ingredients, oxide_dict=oxide_dict, other_dict=other_dict):
+        '''Return a calculations.RecipeModel whose ingredients are just those of the recipe, so that building it and
+           calculating with it takes the same time and memory whatever the size of the library. Other restrictions
+           whose definitions refer to ingredients that aren't in the recipe can't be used with such a model'''
+        return calculations.RecipeModel(oxide_dict, self.load(recipe_ingredients), other_dict)
+
+    def close(self):
+        self.db.close()
+
+class LazyIngredients(Mapping):
+    '''A read-only mapping from the indices of the ingredients in store to Ingredient objects, which are read
+       from the database when they're looked up. The size most recently used ingredients are kept in memory.
+       Iterating over it reads the list of indices, but not the ingredients'''
+
+    def __init__(self, store, size=1000):
+
+        self.store = store
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, index):
+        with self.lock:
+            if index in self.entries:
+                self.entries.move_to_end(index)
+                return self.entries[index]
+        ingredient = self.store.load([index])[index]
+        with self.lock:
+            self.entries[index] = ingredient
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return ingredient
+
+    def __iter__(self):
+        return iter(self.store.indices())
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, index):
+        return index in self.entries or index in self.store
+
+    def forget(self, indices):
+        'Drop the given ingredients from memory, since they have been changed'
+        with self.lock:
+            for index in indices:
+                self.entries.pop(index, None)
+
+class LazyCompositions(Mapping):
+    'A read-only mapping from the indices of the ingredients of a LazyIngredients mapping to their compositions'
+
+    def __init__(self, ingredients):
+        self.ingredients = ingredients
+
+    def __getitem__(self, index):
+        return self.ingredients[index].oxide_comp
+
+    def __iter__(self):
+        return iter(self.ingredients)
+
+    def __len__(self):
+        return len(self.ingredients)
+
+    def __contains__(self, index):
+        return index in self.ingredients
@@ -0,0 +1,100 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# A record of what happened during a calculation, for finding out why a recipe is slow or infeasible. The backends
+# of calc_restrictions fill in a SolveReport if one is passed as the report option (RecipeModel.calc_report does
+# this), with the timings, status and iterations of every solve. The LP files that used to be written before
+# every solve are only written in trace mode.
+
+import os
+from collections import Counter
+
+class SolveReport:
+    '''The instrumentation of one calculation. solves is the list of records of the solves, in the order they were
+       made. Each record is a dictionary with entries
+         'key', 'bound': the restriction and bound (0 for the lower bound, 1 for the upper bound) solved for,
+         'backend': the backend that made the solve,
+         'status': the status of the solve ('Optimal', 'Infeasible', etc),
+         'iterations': the number of simplex iterations or pivots, or None if the backend doesn't say,
+         'update_time', 'solve_time', 'extract_time': the time (in seconds) spent changing the problem for this
+           solve, solving it, and extracting the results (including harvesting).
+       setup_time is the time spent building the problem, counters holds the statistics of the backend (see
+       calc_restrictions), and error is the reason the calculation failed, if it did.
+       Each of the functions in hooks is called with each record as soon as the solve has been made. A hook
+       may raise an exception to stop the calculation, which is then passed on to the caller. Each of the
+       functions in bound_hooks is called with (key, i, value) as soon as bound i of restriction key is known,
+       whether it was solved for or settled by a point found for another bound (see lpmatrix.Harvest).
+       trace controls which LP files are written: None (the default) writes none, 'failure' writes the problem
+       to trace_path when a solve fails, 'all' also writes every problem before it's solved, and a collection
+       of restriction keys also writes the problems for those restrictions. The files for individual problems
+       are named after trace_path, with the key and bound added, e.g. constraints_umf_SiO2_1.lp'''
+
+    def __init__(self, hooks=(), trace=None, trace_path='constraints.lp', bound_hooks=()):
+
+        self.hooks = list(hooks)
+        self.bound_hooks = list(bound_hooks)
+        self.trace = trace
+        self.trace_path = trace_path
+        self.solves = []
+        self.counters = {}
+        self.setup_time = 0
+        self.error = None
+
+    def tracing(self, key):
+        'Return True if the problems for restriction key are to be written before they are solved'
+        if self.trace is None or self.trace == 'failure':
+            return False
+        return self.trace == 'all' or key in self.trace
+
+    def trace_file(self, key=None, i=None):
+        'Return the path of the LP file for bound i of restriction key, or for a failed solve, if key is None'
+        if key is None:
+            return self.trace_path
+        root, ext = os.path.splitext(self.trace_path)
+        return '%s_%s_%i%s' % (root, key, i, ext)
+
+    def record(self, key, i, backend, status, iterations, update_time, solve_time, extract_time):
+        'Record a solve, and call the hooks'
+        solve = {'key': key, 'bound': i, 'backend': backend, 'status': status, 'iterations': iterations,
+                 'update_time': update_time, 'solve_time': solve_time, 'extract_time': extract_time}
+        self.solves.append(solve)
+        for hook in self.hooks:
+            hook(solve)
+
+    def settle(self, key, i, value):
+        'Call the bound hooks for bound i of restriction key, whose value is now known'
+        for hook in self.bound_hooks:
+            hook(key, i, value)
+
+    def totals(self):
+        '''Return a dictionary with the number of solves, the total number of iterations, the total times spent
+           setting up, updating, solving and extracting, and the number of solves with each status'''
+        totals = {'solves': len(self.solves), 'setup_time': self.setup_time}
+        totals['iterations'] = sum(solve['iterations'] or 0 for solve in self.solves)
+        for name in ['update_time', 'solve_time', 'extract_time']:
+            totals[name] = sum(solve[name] for solve in self.solves)
+        totals['statuses'] = dict(Counter(solve['status'] for solve in self.solves))
+        return totals
+
+    def slowest(self, n=5):
+        'Return the records of the n slowest solves'
+        return sorted(self.solves, key=lambda solve: solve['solve_time'], reverse=True)[:n]
+
+    def as_dict(self):
+        'Return the report as a dictionary that can be written as JSON'
+        return {'error': self.error, 'totals': self.totals(), 'counters': dict(self.counters), 'solves': list(self.solves)}
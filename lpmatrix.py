@@ -0,0 +1,884 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# The glaze LP of calculations.py, stored as sparse matrices and solved in-process with HiGHS,
+# instead of being written to a file and handed to an external solver.
+
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+
+from restrictions import *
+from expressions import parse
+from simplex import Simplex
+
+status_names = {0: 'Optimal', 1: 'Iteration limit reached', 2: 'Infeasible', 3: 'Unbounded', 4: 'Numerical difficulties'}
+
+def add_stats(stats, **counts):
+    'Add the counts to the dictionary stats, unless it is None'
+    if stats is not None:
+        for name, count in counts.items():
+            stats[name] = stats.get(name, 0) + count
+
+def report_error(message, errors=None):
+    'Print message, or append it to the list errors if one is given'
+    if errors is None:
+        print(message)
+    else:
+        errors.append(message)
+
+def linear_form(expression, rows):
+    'Return the coefficient vector of expression (see expressions.parse) in terms of rows'
+    return parse(expression).vector(rows)
+
+def significant(x, digits=6, tol=1e-9):
+    '''Round x to the given number of significant digits, which is the precision GLPK reports.
+       Values smaller than tol are rounding errors, and are set to zero'''
+    if abs(x) < tol:
+        return 0.0
+    return float('%.*g' % (digits, x))
+
+# SECTION 1
+# Define MatrixModel class
+
+class MatrixModel:
+    '''The variables and universal restrictions of the LP problem, with the equalities stored as
+       the rows of the sparse matrix base_eq (all with right-hand side 0).
+       Variables are referred to by the same names as the keys of lp_var in calculations.py'''
+
+    def __init__(self, oxide_dict=oxide_dict, ingredient_compositions=ingredient_compositions, other_dict=other_dict,
+                 restr_dict=restr_dict):
+
+        self.oxide_dict = oxide_dict
+        self.ingredient_compositions = ingredient_compositions
+        self.other_dict = other_dict
+        self.restr_dict = restr_dict
+
+        self.var_names = ['ingredient_total', 'fluxes_total', 'ox_mass_total', 'ox_mole_total']
+        self.var_names += ['ingredient_'+index for index in ingredient_compositions]
+        for ox in oxide_dict:
+            self.var_names += ['mole_'+ox, 'mass_'+ox]
+        self.var_names += ['other_'+index for index in other_dict]
+        self.var_index = {name: j for j, name in enumerate(self.var_names)}
+        self.rows_memo = None     # if a dictionary, ingredient_rows stores its results there (see calculations.py, calc_group)
+
+        rows = []
+        for ox in oxide_dict:
+            rows.append({'mole_'+ox: oxide_dict[ox].molar_mass, 'mass_'+ox: -1})   # relate mole percent and unity
+            row = {'ingredient_'+index: comp[ox]/100 for index, comp in ingredient_compositions.items() if ox in comp}
+            row['mass_'+ox] = -1
+            rows.append(row)                                                          # relate ingredients and oxides
+
+        for index, ot in other_dict.items():
+            row = {key: -coef for key, coef in ot.numerator.coefs.items()}
+            row['other_'+index] = 1
+            rows.append(row)                                                          # relate this variable to the other variables
+
+        rows.append(dict([('ingredient_total', 1)] + [('ingredient_'+index, -1) for index in ingredient_compositions]))
+        rows.append(dict([('fluxes_total', 1)] + [('mole_'+ox, -oxide_dict[ox].flux) for ox in oxide_dict]))
+        rows.append(dict([('ox_mass_total', 1)] + [('mass_'+ox, -1) for ox in oxide_dict]))
+        rows.append(dict([('ox_mole_total', 1)] + [('mole_'+ox, -1) for ox in oxide_dict]))
+
+        self.base_eq = self.to_matrix(rows)
+
+    def to_matrix(self, rows):
+        'Convert a list of dictionaries {variable name: coefficient} to a sparse matrix'
+        data, row_ind, col_ind = [], [], []
+        for i, row in enumerate(rows):
+            for name, coef in row.items():
+                if coef != 0:
+                    data.append(coef)
+                    row_ind.append(i)
+                    col_ind.append(self.var_index[name])
+        return sparse.csr_matrix((data, (row_ind, col_ind)), shape=(len(rows), len(self.var_names)))
+
+    def constraint_keys(self, recipe_ingredients, recipe_oxides, recipe_other):
+        'Return the keys of the restrictions whose bounds are imposed as constraints'
+        keys = ['ingredient_'+index for index in recipe_ingredients]
+        for ox in recipe_oxides:
+            keys += ['umf_'+ox, 'mass_perc_'+ox, 'mole_perc_'+ox]
+        keys += ['other_'+index for index in recipe_other]
+        return keys
+
+    def recipe_problem(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, presolve=True):
+        'Return the RecipeProblem for the given recipe, presolved unless presolve is False'
+        if presolve:
+            return self.reduced_problem(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other)
+        else:
+            return self.full_problem(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other)
+
+    def full_problem(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other):
+        '''Return the RecipeProblem whose variables are all the variables of the model. Ingredients that
+           aren't in the recipe are fixed at zero'''
+
+        upper = np.full(len(self.var_names), np.inf)
+        for index in self.ingredient_compositions:
+            if index not in recipe_ingredients:
+                upper[self.var_index['ingredient_'+index]] = 0
+        rows = UnitRows(self.var_index)
+        problem = RecipeProblem(self.base_eq, upper, rows, self.restr_dict, restriction_bounds,
+                                self.constraint_keys(recipe_ingredients, recipe_oxides, recipe_other))
+        problem.ingredient_columns = {index: self.var_index['ingredient_'+index] for index in recipe_ingredients}
+        problem.names = self.var_names
+        return problem
+
+    def reduced_problem(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other):
+        '''Presolve: return the RecipeProblem whose only variables are the amounts of the ingredients in the recipe.
+           The equalities defining the masses and moles of the oxides, the totals and the other restrictions are
+           substituted out, so every other variable is a linear combination of the ingredient amounts. Ingredients
+           that aren't in the recipe (or whose upper bound is zero) and oxides that aren't in the recipe are dropped,
+           together with any constraint that becomes trivial. The size of the problem therefore depends on the
+           recipe, not on the number of ingredients and oxides in the model'''
+
+        ingredients = [index for index in recipe_ingredients if restriction_bounds['ingredient_'+index][1] > 0]
+        rows = self.ingredient_rows(ingredients, recipe_oxides)
+
+        nonnegative = []      # other variables with negative coefficients aren't automatically nonnegative
+        for index in self.other_dict:
+            if (rows['other_'+index] < 0).any():
+                nonnegative.append(-rows['other_'+index])
+
+        problem = RecipeProblem(sparse.csr_matrix((0, len(ingredients))), np.full(len(ingredients), np.inf), rows,
+                                self.restr_dict, restriction_bounds,
+                                self.constraint_keys(recipe_ingredients, recipe_oxides, recipe_other), extra_rows=nonnegative)
+        problem.ingredient_columns = {index: j for j, index in enumerate(ingredients)}
+        problem.names = ['ingredient_'+index for index in ingredients]
+        problem.remove_trivial_rows()
+        return problem
+
+    def ingredient_rows(self, ingredients, recipe_oxides):
+        '''Return the Rows expressing the variables of the model in terms of the amounts of the given ingredients,
+           assuming the other ingredients aren't used. If self.rows_memo is a dictionary, the Rows are kept there
+           and reused for the same ingredients; they aren't modified by the problems that use them'''
+
+        if self.rows_memo is not None:
+            memo_key = (tuple(ingredients), frozenset(recipe_oxides))
+            if memo_key in self.rows_memo:
+                return self.rows_memo[memo_key]
+        n = len(ingredients)
+        rows = Rows(n)
+        rows['ingredient_total'] = np.ones(n)
+        for j, index in enumerate(ingredients):
+            rows['ingredient_'+index] = np.eye(1, n, j)[0]
+
+        rows['fluxes_total'] = np.zeros(n)
+        rows['ox_mass_total'] = np.zeros(n)
+        rows['ox_mole_total'] = np.zeros(n)
+        for ox in recipe_oxides:
+            mass = np.array([self.ingredient_compositions[index].get(ox, 0)/100 for index in ingredients])
+            rows['mass_'+ox] = mass
+            rows['mole_'+ox] = mass/self.oxide_dict[ox].molar_mass
+            rows['fluxes_total'] = rows['fluxes_total'] + self.oxide_dict[ox].flux*rows['mole_'+ox]
+            rows['ox_mass_total'] = rows['ox_mass_total'] + rows['mass_'+ox]
+            rows['ox_mole_total'] = rows['ox_mole_total'] + rows['mole_'+ox]
+
+        for index, ot in self.other_dict.items():
+            rows['other_'+index] = ot.numerator.vector(rows)
+        if self.rows_memo is not None:
+            self.rows_memo[memo_key] = rows
+        return rows
+
+    def unchanged_bounds(self, state, key, bounds, tol=1e-9):
+        '''Return the set of bounds (key, i) of state whose calculated values are unaffected if the bounds
+           on restriction key are changed to bounds. The optimal point recorded for (key, i) is still
+           optimal if it satisfies the new bounds, and if any bound that is loosened had a zero dual
+           there: loosening that constraint then doesn't change the optimality conditions, and tightening
+           a constraint can't improve the optimum. Points that remain optimal after a constraint with a
+           nonzero dual is tightened are kept, but their duals are no longer known'''
+
+        if key not in self.constraint_keys(state.recipe_ingredients, state.recipe_oxides, state.recipe_other):
+            return {(k, i) for k in state.calc_bounds for i in [0,1]}
+
+        rows = self.ingredient_rows(state.recipe_ingredients, state.recipe_oxides)
+        res = self.restr_dict[key]
+        obj = rows[res.objective_func]
+        norm = linear_form(res.normalization, rows)
+        old_low, old_upp = state.restriction_bounds[key]
+        low, upp = bounds
+        loosened = {label for label, change in [((key, 0), old_low - low), ((key, 1), upp - old_upp)] if change > 0}
+        tightened = {label for label, change in [((key, 0), old_low - low), ((key, 1), upp - old_upp)] if change < 0}
+
+        unchanged = set()
+        for bound, (amounts, free) in state.points.items():
+            x = np.array([amounts.get(index, 0) for index in state.recipe_ingredients])
+            value, scale = obj @ x, norm @ x
+            margin = tol*max(1, abs(value), abs(low*scale), abs(upp*scale))
+            if low*scale - value > margin or value - upp*scale > margin:
+                continue
+            if loosened and (free is None or not loosened <= free):
+                continue
+            unchanged.add(bound)
+            if tightened and free is not None and not tightened <= free:
+                state.points[bound] = (amounts, None)
+        return unchanged
+
+    def calc_projection(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, x_key, y_key, tol=None,
+                        stats=None, presolve=True, errors=None):
+        '''Return the vertices, in anticlockwise order, of the projection of the feasible region onto the
+           restrictions x_key and y_key, or None if it can't be found, in which case the status of the solve that
+           failed is passed to report_error with errors. If both restrictions have the same normalization, the
+           projection of the region is a linear image of a polytope, so it's found exactly (up to tol) by
+           support_polygon, with about two solves per edge. Otherwise, the region is sliced along x by
+           slice_polygon, which approximates curved boundaries to within tol. Between changes of the optimal basis,
+           the bounds of a slice are rational functions of x, given by the basis, so each slice first checks whether
+           the bases of its neighbouring slices are still optimal (Simplex.basis_value, a factorization without
+           pivots), and only solves where the basis changes. That's two solves for the x range, two for the first
+           slice and about one for each change of basis along the lower and upper boundaries: typically 4 to 13
+           solves, rather than two for every slice. If tol is None, it's 1e-6 in the first case, and 1e-3 in the
+           second, which is enough for plotting. All solves in each case share one Simplex object, so only the
+           first needs to find a feasible basis, and a solve the simplex method fails on is made again with HiGHS.
+           If a dictionary stats is given, the numbers of solves, of slice bounds found from a neighbouring basis
+           without a solve (reused), and of solves handed over to HiGHS (fallbacks) are added to it'''
+
+        problem = self.recipe_problem(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, presolve)
+        A, b, keep = problem.standard_form()
+        n = keep.sum()
+        slack = np.zeros(problem.A_ub.shape[0])
+        res_x, res_y = self.restr_dict[x_key], self.restr_dict[y_key]
+        obj_x = problem.rows[res_x.objective_func][keep]
+        obj_y = problem.rows[res_y.objective_func][keep]
+        norm_x = problem.linear_form(res_x.normalization)[keep]
+        norm_y = problem.linear_form(res_y.normalization)[keep]
+        solves = [0]
+        reused = [0]            # slice bounds found from the optimal basis of a neighbouring slice, without a solve
+        failure = ['No solution']
+
+        def solve(simplex, c):
+            status = simplex.solve(np.r_[c, slack], fallback=True)
+            solves[0] += 1
+            if status != 'Optimal':
+                failure[0] = status
+                return
+            return simplex.x[:n]
+
+        simplex = Simplex(A, b)
+        slicer = None
+        simplex.set_row(-1, np.r_[norm_x, slack], 1)
+        if res_x.normalization == res_y.normalization:
+            def support(d):
+                z = solve(simplex, -(d[0]*obj_x + d[1]*obj_y))
+                if z is not None:
+                    return np.array([obj_x @ z, obj_y @ z])
+            polygon = support_polygon(support, 1e-6 if tol is None else tol)
+        else:
+            x_range = [solve(simplex, sign*obj_x) for sign in [1,-1]]
+            if x_range[0] is None or x_range[1] is None:
+                add_stats(stats, solves=solves[0], fallbacks=simplex.fallbacks)
+                report_error(failure[0], errors)
+                return
+            x_min, x_max = obj_x @ x_range[0], obj_x @ x_range[1]
+            # restrict the region to x = t with the row (obj_x - t*norm_x).z = 0, and normalize y
+            A_slice = np.vstack([A[:-1], np.r_[obj_x, slack], np.r_[norm_y, slack]])
+            b_slice = np.r_[b[:-1], 0, 1]
+            slicer = Simplex(A_slice, b_slice)
+
+            def y_range(t, hints):
+                slicer.set_row(-2, np.r_[obj_x - t*norm_x, slack], 0)
+                interval, bases = [], []
+                for sign, candidates in zip([1,-1], hints):
+                    c = np.r_[sign*obj_y, slack]
+                    for basis in candidates:          # a basis that's still optimal gives the bound without pivots
+                        value = slicer.basis_value(c, basis)
+                        if value is not None:
+                            reused[0] += 1
+                            break
+                    else:
+                        if solve(slicer, sign*obj_y) is None:
+                            return
+                        basis = None if slicer.basis is None else tuple(slicer.basis)
+                        value = slicer.value
+                    interval.append(sign*value)
+                    bases.append(basis)
+                return interval, bases
+            polygon = slice_polygon(y_range, x_min, x_max, 1e-3 if tol is None else tol)
+
+        add_stats(stats, solves=solves[0], reused=reused[0],
+                  fallbacks=simplex.fallbacks + (slicer.fallbacks if slicer else 0))
+        if polygon is None:
+            report_error(failure[0], errors)
+            return
+        return [(significant(x), significant(y)) for x, y in polygon]
+
+    def calc_bounds(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, keys=None, stats=None,
+                    presolve=True, harvest=True, points=None, errors=None, report=None):
+        '''Solve the min/max problems for every key of restriction_bounds (or just those in keys, if given).
+           Returns the dictionary of calculated bounds, or None (after printing the problem status, or appending
+           it to the list errors, if given) if a solve fails. If an instrumentation.SolveReport report is given,
+           each solve is recorded there, and LP files are written as it says.
+           If a dictionary stats is given, the numbers of solves, points harvested and bounds settled without
+           a solve are added to it. If a dictionary points is given, points[(key, i)] is set to an optimal point
+           for bound i of key, as described in BoundsState'''
+
+        start = time.perf_counter()
+        problem = self.recipe_problem(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, presolve)
+        if keys is None:
+            keys = list(restriction_bounds)
+        if harvest:
+            harvest = Harvest(problem, self.restr_dict, restriction_bounds, keys,
+                              self.constraint_keys(recipe_ingredients, recipe_oxides, recipe_other))
+        if report is not None:
+            report.setup_time += time.perf_counter() - start
+        b_ub = np.zeros(problem.A_ub.shape[0])
+        b_eq = np.zeros(problem.A_eq.shape[0] + 1)
+        b_eq[-1] = 1
+        bounds = np.column_stack([np.zeros(len(problem.upper)), problem.upper])
+
+        calc_bounds = {key: list([0,0]) for key in keys}
+        solves = 0
+        try:
+            for key in keys:
+                start = time.perf_counter()
+                res = self.restr_dict[key]
+                norm = sparse.csr_matrix(problem.linear_form(res.normalization))   # Apply the normalization of the restriction in question
+                A_eq = sparse.vstack([problem.A_eq, norm], format='csr')
+                for sign in [1,-1]:
+                    i = int((sign+1)/2)           # 1 -> 1 (upper), -1 -> 0 (lower)
+                    if harvest and (key, i) not in harvest.pending:
+                        continue
+                    c = -sign*problem.rows[res.objective_func]       # linprog minimizes
+                    if report is not None and report.tracing(key):
+                        problem.write_lp(report.trace_file(key, i), c, norm.toarray()[0])
+                    solve_start = time.perf_counter()
+                    result = linprog(c, A_ub=problem.A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds,
+                                     method='highs')
+                    solve_end = time.perf_counter()
+                    solves += 1
+                    if result.status == 0:
+                        calc_bounds[key][i] = significant(abs(result.fun))
+                        if points is not None:
+                            points[(key, i)] = (problem.amounts(result.x), problem.free_labels(result.ineqlin.marginals))
+                        if harvest:
+                            harvest.pending.discard((key, i))
+                            for bound in harvest.record(result.x, calc_bounds):
+                                if points is not None:
+                                    points[bound] = (problem.amounts(result.x), None)
+                    status = status_names.get(result.status, 'No solution. Problem status '+str(result.status))
+                    if report is not None:
+                        report.record(key, i, 'highs', status, result.nit, solve_start - start, solve_end - solve_start,
+                                      time.perf_counter() - solve_end)
+                        if result.status == 0:
+                            for k, j in [(key, i)] + (harvest.new if harvest else []):
+                                report.settle(k, j, calc_bounds[k][j])
+                        if result.status != 0 and report.trace is not None:
+                            problem.write_lp(report.trace_file(), c, norm.toarray()[0])
+                    if result.status != 0:
+                        report_error(status, errors)
+                        return
+                    start = time.perf_counter()
+        finally:
+            add_stats(stats, solves=solves, points=harvest.points if harvest else 0,
+                      settled=harvest.settled if harvest else 0)
+        return calc_bounds
+
+    def calc_bounds_warm(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, keys=None, stats=None,
+                         presolve=True, harvest=True, points=None, errors=None, report=None):
+        '''Same as calc_bounds, but all problems are solved with one Simplex object, so each solve starts
+           from the optimal basis of the previous one. The constraints only differ in the normalization,
+           and since they're homogeneous, a basis remains feasible under a new normalization unless the
+           new normalization vanishes at the old solution. The solves are ordered so that restrictions
+           sharing a normalization are done consecutively. A solve that the simplex method fails on is made
+           again with HiGHS (see Simplex.solve). If a dictionary stats is given, the numbers of solves, points
+           harvested, bounds settled without a solve, pivots, cold and warm starts, pivots saved and solves
+           handed over to HiGHS (fallbacks) are added to it'''
+
+        start = time.perf_counter()
+        problem = self.recipe_problem(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, presolve)
+        A, b, keep = problem.standard_form()
+        simplex = Simplex(A, b)
+        slack = np.zeros(problem.A_ub.shape[0])
+
+        if keys is None:
+            keys = list(restriction_bounds)
+        if harvest:
+            harvest = Harvest(problem, self.restr_dict, restriction_bounds, keys,
+                              self.constraint_keys(recipe_ingredients, recipe_oxides, recipe_other), keep)
+        if report is not None:
+            report.setup_time += time.perf_counter() - start
+        order = sorted(keys, key=lambda key: self.restr_dict[key].normalization)   # sorted is stable
+        calc_bounds = {key: list([0,0]) for key in keys}
+        normalization = None
+        solves = 0
+        try:
+            for key in order:
+                res = self.restr_dict[key]
+                for sign in [1,-1]:
+                    i = int((sign+1)/2)           # 1 -> 1 (upper), -1 -> 0 (lower)
+                    if harvest and (key, i) not in harvest.pending:
+                        continue
+                    start = time.perf_counter()
+                    if res.normalization != normalization:
+                        normalization = res.normalization
+                        simplex.set_row(-1, np.r_[problem.linear_form(normalization)[keep], slack], 1)
+                    if report is not None and report.tracing(key):
+                        problem.write_lp(report.trace_file(key, i), -sign*problem.rows[res.objective_func],
+                                         problem.linear_form(normalization))
+                    pivots = simplex.pivots
+                    solve_start = time.perf_counter()
+                    status = simplex.solve(np.r_[-sign*problem.rows[res.objective_func][keep], slack], fallback=True)
+                    solve_end = time.perf_counter()
+                    solves += 1
+                    if status == 'Optimal':
+                        calc_bounds[key][i] = significant(abs(simplex.value))
+                        x = np.zeros(len(keep))
+                        x[keep] = simplex.x[:keep.sum()]
+                        if points is not None:
+                            cost = np.r_[-sign*problem.rows[res.objective_func][keep], slack]
+                            duals = simplex.reduced_costs(cost)[keep.sum():]
+                            points[(key, i)] = (problem.amounts(x), problem.free_labels(duals))
+                        if harvest:
+                            harvest.pending.discard((key, i))
+                            for bound in harvest.record(x[keep], calc_bounds, simplex, normalization):
+                                if points is not None:
+                                    points[bound] = (problem.amounts(x), None)
+                    if report is not None:
+                        report.record(key, i, 'simplex', status, simplex.pivots - pivots, solve_start - start,
+                                      solve_end - solve_start, time.perf_counter() - solve_end)
+                        if status == 'Optimal':
+                            for k, j in [(key, i)] + (harvest.new if harvest else []):
+                                report.settle(k, j, calc_bounds[k][j])
+                        if status != 'Optimal' and report.trace is not None:
+                            problem.write_lp(report.trace_file(), -sign*problem.rows[res.objective_func],
+                                             problem.linear_form(normalization))
+                    if status != 'Optimal':
+                        report_error(status, errors)
+                        return
+        finally:
+            add_stats(stats, solves=solves, points=harvest.points if harvest else 0,
+                      settled=harvest.settled if harvest else 0, pivots=simplex.pivots, cold_starts=simplex.cold_starts,
+                      warm_starts=simplex.warm_starts, pivots_saved=simplex.pivots_saved, fallbacks=simplex.fallbacks)
+        return calc_bounds
+
+# SECTION 2
+# Define RecipeProblem class
+
+class Rows(dict):
+    'Coefficient vectors of the variables. Variables that are identically zero may be left out'
+
+    def __init__(self, n):
+        self.n = n
+
+    def __missing__(self, name):
+        return np.zeros(self.n)
+
+    def evaluate(self, x):
+        'Return the values of the variables at the point x'
+        return {name: row @ x for name, row in self.items()}
+
+class UnitRows(Rows):
+    '''The coefficient vectors of the variables, when they're the variables of the problem themselves. The unit
+       vector of a variable is built from var_index the first time it's needed, so only the variables used by
+       the restrictions are stored, rather than a vector for every variable of the model'''
+
+    def __init__(self, var_index):
+        Rows.__init__(self, len(var_index))
+        self.var_index = var_index
+
+    def __missing__(self, name):
+        if name not in self.var_index:
+            return np.zeros(self.n)
+        row = np.zeros(self.n)
+        row[self.var_index[name]] = 1
+        self[name] = row
+        return row
+
+    def evaluate(self, x):
+        return dict(zip(self.var_index, x))
+
+class RecipeProblem:
+    '''The constraints of the LP problem for one recipe, in the form A_eq x = 0, A_ub x <= 0, 0 <= x <= upper.
+       rows[name] is the coefficient vector of the model variable name, in terms of x. The rows of A_ub are
+       the lower and upper bounds of the restrictions in constraint_keys, and labels[i] = (key, 0) or (key, 1)
+       records which bound row i comes from'''
+
+    def __init__(self, A_eq, upper, rows, restr_dict, restriction_bounds, constraint_keys, extra_rows=[]):
+
+        self.A_eq = A_eq
+        self.upper = upper
+        self.rows = rows
+
+        bound_rows = []
+        self.labels = []
+        for key in constraint_keys:
+            res = restr_dict[key]
+            obj = rows[res.objective_func]
+            norm = self.linear_form(res.normalization)
+            low, upp = restriction_bounds[key]
+            bound_rows += [low*norm - obj, obj - upp*norm]     # lower and upper bounds
+            self.labels += [(key, 0), (key, 1)]
+        for row in extra_rows:
+            bound_rows.append(row)
+            self.labels.append((None, None))
+        self.A_ub = sparse.csr_matrix(np.array(bound_rows).reshape(len(bound_rows), len(upper)))
+
+    def linear_form(self, expression):
+        'Return the coefficient vector of a normalization'
+        return linear_form(expression, self.rows)
+
+    def remove_trivial_rows(self, tol=1e-12):
+        'Remove the rows of A_ub that are zero, since every x satisfies them'
+        A_ub = self.A_ub.toarray()
+        size = np.abs(A_ub).max(axis=1) if A_ub.size else np.zeros(A_ub.shape[0])
+        keep = size > tol*max(1, size.max(initial=0))
+        self.A_ub = sparse.csr_matrix(A_ub[keep])
+        self.labels = [label for label, k in zip(self.labels, keep) if k]
+
+    def values(self, x):
+        'Map a solution x back to the values of the variables of the model'
+        return self.rows.evaluate(x)
+
+    def add_row(self, row, label):
+        'Add a row to A_ub'
+        self.A_ub = sparse.vstack([self.A_ub, sparse.csr_matrix(row)], format='csr')
+        self.labels.append(label)
+
+    def amounts(self, x):
+        'Return the dictionary of the amounts of the ingredients in the solution x'
+        return {index: x[j] for index, j in self.ingredient_columns.items()}
+
+    def free_labels(self, duals, tol=1e-9):
+        '''Return the set of labels of the rows of A_ub whose duals (or the reduced costs of their slack
+           variables) are zero'''
+        return {label for label, dual in zip(self.labels, duals) if label[0] is not None and abs(dual) <= tol}
+
+    def write_lp(self, path, c, norm):
+        '''Write the problem of minimizing c.x subject to the constraints and the normalization norm.x = 1 to path,
+           in CPLEX LP format, which most solvers read. The variables are named as in the model'''
+
+        def terms(row):
+            row = np.ravel(row)
+            nonzero = [j for j in range(len(row)) if row[j] != 0] or [0]
+            return ' '.join('%+.12g %s' % (row[j], self.names[j]) for j in nonzero)
+
+        lines = ['\\ The LP problem for one bound of a recipe', 'Minimize', ' obj: ' + terms(c), 'Subject To']
+        for k, row in enumerate(self.A_eq.toarray()):
+            lines.append(' eq_%i: %s = 0' % (k, terms(row)))
+        lines.append(' normalization: %s = 1' % terms(norm))
+        extra = 0
+        for (key, i), row in zip(self.labels, self.A_ub.toarray()):
+            if key is None:
+                name = 'nonnegative_%i' % extra
+                extra += 1
+            else:
+                name = key + ['_lower', '_upper'][i]
+            lines.append(' %s: %s <= 0' % (name, terms(row)))
+        lines.append('Bounds')
+        for name, upper in zip(self.names, self.upper):
+            lines.append(' %s >= 0' % name if upper == np.inf else ' 0 <= %s <= %.12g' % (name, upper))
+        lines.append('End')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def standard_form(self):
+        '''Return the dense matrix A and vector b of the constraints in the form A x = b, x >= 0, where
+           x consists of the variables that aren't fixed at zero, followed by the slack variables of A_ub.
+           The last row is the normalization, which is initially zero. Also returns the boolean mask of
+           the variables that are kept'''
+        keep = self.upper > 0
+        n = keep.sum()
+        m_eq, m_ub = self.A_eq.shape[0], self.A_ub.shape[0]
+        A = np.zeros((m_eq + m_ub + 1, n + m_ub))
+        A[:m_eq, :n] = self.A_eq[:, keep].toarray()
+        A[m_eq:m_eq+m_ub, :n] = self.A_ub[:, keep].toarray()
+        A[m_eq:m_eq+m_ub, n:] = np.eye(m_ub)
+        b = np.zeros(A.shape[0])
+        b[-1] = 1
+        return A, b, keep
+
+# SECTION 3
+# Define Harvest class
+
+class Harvest:
+    '''Every optimal point found while calculating the bounds is a feasible recipe, at which the value of every
+       restriction is known. record evaluates the bounds that are still pending at such a point, and settles those
+       whose answer the point determines:
+         - the point attains the bound on the restriction given in restriction_bounds, which is imposed as a constraint,
+         - the value is 0 and the restriction can't be negative, for a lower bound,
+         - the simplex basis that gave the point is also optimal for the restriction (same normalization only).
+       The other bounds still have to be solved for. keep is the mask of the problem variables present in the points'''
+
+    def __init__(self, problem, restr_dict, restriction_bounds, keys, constraint_keys, keep=None, tol=1e-9):
+
+        if keep is None:
+            keep = np.ones(len(problem.upper), dtype=bool)
+        self.restriction_bounds = restriction_bounds
+        self.constrained = set(constraint_keys)
+        self.tol = tol
+        self.pending = {(key, i) for key in keys for i in [0,1]}
+        self.normalization = {key: restr_dict[key].normalization for key in keys}
+        self.obj = {key: problem.rows[restr_dict[key].objective_func][keep] for key in keys}
+        self.norm = {normalization: problem.linear_form(normalization)[keep] for normalization in set(self.normalization.values())}
+        self.points = 0       # number of points recorded
+        self.settled = 0      # number of bounds settled without a solve
+        self.new = []         # bounds settled by the last point recorded
+
+    def settle(self, key, i, value, calc_bounds):
+        calc_bounds[key][i] = significant(abs(value))
+        self.pending.discard((key, i))
+        self.settled += 1
+        self.new.append((key, i))
+
+    def record(self, x, calc_bounds, simplex=None, normalization=None):
+        '''Settle the pending bounds determined by the point x, and return the list of them. If simplex
+           is given, x is its optimal solution, with the given normalization'''
+        self.points += 1
+        self.new = []
+        for key, i in list(self.pending):
+            scale = self.norm[self.normalization[key]] @ x
+            if scale <= self.tol:
+                continue
+            value = self.obj[key] @ x / scale
+            bound = self.restriction_bounds[key][i]
+            if key in self.constrained and abs(value - bound) <= self.tol*max(1, abs(bound)):
+                self.settle(key, i, bound, calc_bounds)
+            elif i == 0 and value <= self.tol and (self.obj[key] >= 0).all():
+                self.settle(key, i, 0, calc_bounds)
+
+        if simplex is not None:
+            same = [(key, i) for key, i in self.pending if self.normalization[key] == normalization]
+            if same:
+                C = np.zeros((len(same), simplex.A.shape[1]))
+                for r, (key, i) in enumerate(same):
+                    C[r, :len(x)] = (1 - 2*i)*self.obj[key]          # i = 1 is a maximum
+                for (key, i), optimal in zip(same, simplex.is_optimal(C)):
+                    if optimal:
+                        self.settle(key, i, self.obj[key] @ x, calc_bounds)
+        return self.new
+
+# SECTION 4
+# Define BoundsState class
+
+class BoundsState:
+    '''The result of a calculation, together with what is needed to update it when a bound is changed:
+       the inputs, and for each bound (key, i), points[(key, i)] = (amounts, free), where amounts is the
+       dictionary of the amounts of the ingredients at an optimal point, and free is the set of labels of
+       the constraints with zero duals there, or None if the duals aren't known'''
+
+    def __init__(self, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, backend, options):
+
+        self.restriction_bounds = {key: list(bounds) for key, bounds in restriction_bounds.items()}
+        self.recipe_ingredients = list(recipe_ingredients)
+        self.recipe_oxides = recipe_oxides
+        self.recipe_other = list(recipe_other)
+        self.backend = backend
+        self.options = options
+        self.calc_bounds = None
+        self.points = {}
+
+# SECTION 5
+# Define Sweep class
+
+class Sweep:
+    '''Calculates the bounds of the restrictions in restriction_bounds while bound i of restriction key varies.
+       The constraint given by that bound is v*norm - obj <= 0 (i = 0) or obj - v*norm <= 0 (i = 1), so the
+       parameter v appears in the coefficients, rather than the right hand side. For each bound, an optimal
+       point, its basis and its set of constraints with zero duals are kept from one step to the next. A bound
+       is unchanged if its point still satisfies the constraint, and the constraint has been tightened, or
+       loosened with a zero dual (see MatrixModel.unchanged_bounds). Otherwise, the bound's last basis is refactored
+       with the new constraint. If it's still feasible and optimal, no pivots are needed, so pivots only occur where
+       the parameter crosses a breakpoint, at which the optimal basis changes'''
+
+    def __init__(self, model, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, key, i, values,
+                 presolve=True, tol=1e-9):
+
+        bounds = {k: list(b) for k, b in restriction_bounds.items()}
+        bounds[key][i] = max(values) if i == 1 else min(values)     # the loosest value, so presolve keeps what's needed
+        problem = model.recipe_problem(bounds, recipe_ingredients, recipe_oxides, recipe_other, presolve)
+        res = model.restr_dict[key]
+        self.key, self.i, self.tol = key, i, tol
+        self.obj = problem.rows[res.objective_func]
+        self.norm = problem.linear_form(res.normalization)
+        self.constrained = key in model.constraint_keys(recipe_ingredients, recipe_oxides, recipe_other)
+        if self.constrained and (key, i) not in problem.labels:      # removed as trivial at this value, but not at others
+            problem.add_row(self.constraint(bounds[key][i]), (key, i))
+
+        A, b, self.keep = problem.standard_form()
+        self.simplex = Simplex(A, b)
+        self.problem = problem
+        self.restr_dict = model.restr_dict
+        self.order = list(restriction_bounds)
+        self.keys = sorted(self.order, key=lambda k: model.restr_dict[k].normalization)
+        self.slack = np.zeros(problem.A_ub.shape[0])
+        if self.constrained:
+            j = problem.labels.index((key, i))
+            self.row = problem.A_eq.shape[0] + j - A.shape[0]      # negative, since phase 1 may remove earlier rows
+            self.row_slack = np.eye(1, len(self.slack), j)[0]
+        self.normalization = None
+        self.points = {}       # (k, j) -> (value of the parameter, calculated bound, x, free labels or None, basis)
+        self.calc_bounds = None
+
+    def constraint(self, value):
+        'Return the coefficients of the varying constraint, for the given value of the parameter'
+        return value*self.norm - self.obj if self.i == 0 else self.obj - value*self.norm
+
+    def step(self, value, stats=None, errors=None):
+        '''Return the calculated bounds for the given value of the parameter, or None if a solve fails, in which
+           case its status is passed to report_error with errors. A solve that fails from the bound's last basis
+           is made again from scratch, first with phase 1 and then with HiGHS (see Simplex.solve). If a dictionary
+           stats is given, the numbers of solves, bounds left unchanged, pivots, breakpoints (solves that needed
+           pivots) and solves handed over to HiGHS (fallbacks) are added to it'''
+
+        if not self.constrained and self.calc_bounds is not None:
+            return {k: list(b) for k, b in self.calc_bounds.items()}
+
+        keep, simplex, label = self.keep, self.simplex, (self.key, self.i)
+        constraint = self.constraint(value)[keep]
+        if self.constrained:
+            simplex.set_row(self.row, np.r_[constraint, self.row_slack], 0)
+        calc_bounds = {k: list([0,0]) for k in self.order}
+        solves = unchanged = breakpoints = 0
+        start, fallbacks = simplex.pivots, simplex.fallbacks
+
+        for k in self.keys:
+            res = self.restr_dict[k]
+            for sign in [1,-1]:
+                j = int((sign+1)/2)           # 1 -> 1 (upper), -1 -> 0 (lower)
+                basis = None
+                if (k, j) in self.points:
+                    at, bound, x, free, basis = self.points[(k, j)]
+                    loosened = value < at if self.i == 0 else value > at
+                    margin = self.tol*max(1, abs(value*(self.norm[keep] @ x)), abs(self.obj[keep] @ x))
+                    if constraint @ x <= margin and (not loosened or (free is not None and label in free)):
+                        if free is not None and label not in free and value != at:
+                            free = None        # the constraint was tightened, so its dual may have changed
+                        self.points[(k, j)] = (value, bound, x, free, basis)
+                        calc_bounds[k][j] = bound
+                        unchanged += 1
+                        continue
+                if res.normalization != self.normalization:
+                    self.normalization = res.normalization
+                    simplex.set_row(-1, np.r_[self.problem.linear_form(res.normalization)[keep], self.slack], 1)
+                cost = np.r_[-sign*self.problem.rows[res.objective_func][keep], self.slack]
+                pivots = simplex.pivots
+                status = simplex.solve(cost, basis, fallback=True)
+                solves += 1
+                if status != 'Optimal':
+                    report_error(status, errors)
+                    add_stats(stats, solves=solves, unchanged=unchanged, pivots=simplex.pivots - start,
+                              breakpoints=breakpoints, fallbacks=simplex.fallbacks - fallbacks)
+                    return
+                if basis is not None and simplex.pivots > pivots:
+                    breakpoints += 1
+                calc_bounds[k][j] = significant(abs(simplex.value))
+                free = self.problem.free_labels(simplex.reduced_costs(cost)[keep.sum():])
+                basis = None if simplex.basis is None else list(simplex.basis)     # None after a HiGHS solve
+                self.points[(k, j)] = (value, calc_bounds[k][j], simplex.x[:keep.sum()], free, basis)
+
+        add_stats(stats, solves=solves, unchanged=unchanged, pivots=simplex.pivots - start, breakpoints=breakpoints,
+                  fallbacks=simplex.fallbacks - fallbacks)
+        self.calc_bounds = calc_bounds
+        return {k: list(b) for k, b in calc_bounds.items()}
+
+# SECTION 6
+# Two-dimensional projections of the feasible region
+
+def support_polygon(support, tol=1e-6):
+    '''Return the vertices, in anticlockwise order, of the convex polygon whose support function is given.
+       support(d) must return a point p of the polygon maximizing d.p, or None if it can't be found.
+       Starting from the points that are extreme in the directions of the axes, each edge pq found so far
+       is tested with its outward normal d: if the support point r is further out than pq, r is a new vertex,
+       and the edges pr and rq are tested in turn. Otherwise pq is an edge of the polygon. The number of
+       calls is therefore about twice the number of edges. New vertices closer than tol times the size of
+       the polygon to the edge being tested are ignored, so a larger tol gives an approximation with fewer
+       vertices. Returns None if support fails'''
+
+    points = [support(np.array(d, dtype=float)) for d in [(1,0), (0,1), (-1,0), (0,-1)]]
+    if any(p is None for p in points):
+        return
+    size = max(np.ptp([p[0] for p in points]), np.ptp([p[1] for p in points]), 1e-12)
+
+    def refine(p, q):
+        d = np.array([q[1] - p[1], p[0] - q[0]])      # the edge pq, rotated clockwise
+        if np.hypot(*d) <= tol*size:
+            return []
+        r = support(d)
+        if r is None:
+            raise ValueError
+        if d @ r - d @ p <= tol*size*np.hypot(*d):
+            return []
+        return refine(p, r) + [r] + refine(r, q)
+
+    vertices = []
+    try:
+        for p, q in zip(points, points[1:] + points[:1]):
+            vertices += [p] + refine(p, q)
+    except ValueError:
+        return
+    polygon = []
+    for v in vertices:
+        if not polygon or np.hypot(*(v - polygon[-1])) > tol*size:
+            polygon.append(v)
+    while len(polygon) > 1 and np.hypot(*(polygon[0] - polygon[-1])) <= tol*size:
+        polygon.pop()
+    return polygon
+
+def slice_polygon(y_range, x_min, x_max, tol=1e-6, slices=8, max_depth=8):
+    '''Return the vertices, in anticlockwise order, of a polygon approximating a region whose intersection with each
+       vertical line x = t, for x_min <= t <= x_max, is an interval (low, high), or None if it can't be found.
+       y_range(t, hints) must return ((low, high), bases), or None if it fails, where bases is a pair saying how
+       low and high were found (for calc_projection, their optimal bases), and hints is a pair of lists of such
+       bases, for low and high, to try first. The region is sliced at slices+1 equally spaced values of t, and
+       each gap is bisected while the bounds at the midpoint differ from the linear interpolation by more than tol
+       times the height of the region (at most max_depth times). Each slice is given the bases of its neighbours
+       as hints, so a new basis only has to be found where the boundary changes from one basis to another'''
+
+    width = x_max - x_min
+    ts = [x_min + k*width/slices for k in range(slices + 1)]
+    ranges = []         # (t, (low, high), bases) for each slice
+    hints = ([], [])
+    for k, t in enumerate(ts):
+        found = y_range(t, hints)
+        if found is None and k in [0, slices]:    # at the ends, rounding errors can make the slice infeasible
+            t = t + (tol if k == 0 else -tol)*width
+            found = y_range(t, hints)
+        if found is None:
+            return
+        ranges.append((t, np.array(found[0]), found[1]))
+        hints = ([found[1][0]], [found[1][1]])
+    height = max(max(r[1] for t, r, bases in ranges) - min(r[0] for t, r, bases in ranges), 1e-12)
+
+    def refine(s0, s1, depth):
+        (t0, r0, bases0), (t1, r1, bases1) = s0, s1
+        t = (t0 + t1)/2
+        hints = tuple([bases0[j]] if bases0[j] == bases1[j] else [bases0[j], bases1[j]] for j in [0,1])
+        found = y_range(t, hints)
+        if found is None:
+            raise ValueError
+        s = (t, np.array(found[0]), found[1])
+        if depth >= max_depth or np.abs(s[1] - (r0 + r1)/2).max() <= tol*height:
+            return [s]
+        return refine(s0, s, depth+1) + [s] + refine(s, s1, depth+1)
+
+    boundary = [ranges[0]]
+    try:
+        for k in range(slices):
+            if width > 0:
+                boundary += refine(ranges[k], ranges[k+1], 1)
+            boundary.append(ranges[k+1])
+    except ValueError:
+        return
+    lower = [np.array([t, r[0]]) for t, r, bases in boundary]
+    upper = [np.array([t, r[1]]) for t, r, bases in reversed(boundary)]
+    polygon = []
+    for v in lower + upper:
+        if not polygon or np.hypot(*(v - polygon[-1])) > 1e-12*max(width, height):
+            polygon.append(v)
+    while len(polygon) > 1 and np.hypot(*(polygon[0] - polygon[-1])) <= 1e-12*max(width, height):
+        polygon.pop()
+    return polygon
@@ -18,6 +18,15 @@
 
 # We define the Restriction, Oxide, Ingredient,and Other classes
 
+from expressions import LinearExpression, parse
+
+# The normalizations of the oxide and ingredient restrictions. Normalizations may also be given as dictionaries
+# {variable name: coefficient}, or as strings like "0.01*lp_var['ox_mass_total']"
+umf_normalization = LinearExpression({'fluxes_total': 1})
+mass_perc_normalization = LinearExpression({'ox_mass_total': 0.01})
+mole_perc_normalization = LinearExpression({'ox_mole_total': 0.01})
+ingredient_normalization = LinearExpression({'ingredient_total': 0.01})
+
 # SECTION 1
 # Define Restriction class
 
@@ -29,7 +38,7 @@ class Restriction:
         self.index = index     # We will always have restr_dict[index] = Restriction(index, ...)
         self.name = name
         self.objective_func = objective_func
-        self.normalization = normalization
+        self.normalization = parse(normalization)     # a LinearExpression
         self.default_low = default_low
         self.default_upp = default_upp
         self.dec_pt = dec_pt
@@ -85,42 +94,50 @@ class Other:
         self.numerator_coefs = numerator_coefs   # a dictionary with keys of the form mass_ox, mole_ox, ingredient_i,
                                                  # and values real numbers that are the coefficients in the linear
                                                  # combination of basic variables that define the numerator.
-        self.normalization = normalization     # For now, just a text string of the form 'lp_var[...]'
+        self.numerator = parse(numerator_coefs)
+        self.normalization = parse(normalization)     # a LinearExpression. May be given as a dictionary like numerator_coefs
         self.def_low = def_low
         self.def_upp = def_upp
         self.dec_pt = dec_pt
 
 other_dict = {}
-other_dict['0'] = Other('SiO2_Al2O3', {'mole_SiO2':1}, "lp_var['mole_Al2O3']", 3, 18, 2)   # Using 'SiO2:Al2O3' gives an error
-other_dict['1'] = Other('KNaO UMF', {'mole_K2O':1, 'mole_Na2O':1}, "lp_var['fluxes_total']", 0, 1, 3)
-other_dict['2'] = Other('KNaO % mol', {'mole_K2O':1, 'mole_Na2O':1}, "0.01*lp_var['ox_mole_total']", 0, 100, 1)
-other_dict['3'] = Other('RO UMF', {'mole_MgO':1, 'mole_CaO':1, 'mole_BaO':1, 'mole_SrO':1}, "lp_var['fluxes_total']", 0, 1, 3)
+other_dict['0'] = Other('SiO2_Al2O3', {'mole_SiO2':1}, {'mole_Al2O3':1}, 3, 18, 2)   # Using 'SiO2:Al2O3' gives an error
+other_dict['1'] = Other('KNaO UMF', {'mole_K2O':1, 'mole_Na2O':1}, umf_normalization, 0, 1, 3)
+other_dict['2'] = Other('KNaO % mol', {'mole_K2O':1, 'mole_Na2O':1}, mole_perc_normalization, 0, 100, 1)
+other_dict['3'] = Other('RO UMF', {'mole_MgO':1, 'mole_CaO':1, 'mole_BaO':1, 'mole_SrO':1}, umf_normalization, 0, 1, 3)
 
 
 # SECTION 5
 # Initialize the restr_dict dictionary
 # Define default recipe bounds (optional)
 
-restr_dict = {}  # a dictionary with keys of the form 'umf_'+ox, 'mass_perc_'+ox, 'mole_perc_'+ox, 'ingredient_'+index or 'other_'+index
-
-for ox in oxide_dict:   # create oxide restrictions
-    def_upp = 1   # default upper bound for oxide UMF
-    dp = 3
-    if ox == 'SiO2':
-        def_upp = 100
-        dp = 2
-    elif ox == 'Al2O3':
-        def_upp = 10
-    restr_dict['umf_'+ox] = Restriction('umf_'+ox, ox, 'mole_'+ox, "lp_var['fluxes_total']", 0, def_upp, dec_pt = dp)
-    restr_dict['mass_perc_'+ox] = Restriction('mass_perc_'+ox, ox, 'mass_'+ox, "0.01*lp_var['ox_mass_total']", 0, 100, dec_pt = 2) 
-    restr_dict['mole_perc_'+ox] = Restriction('mole_perc_'+ox, ox, 'mole_'+ox, "0.01*lp_var['ox_mole_total']", 0, 100, dec_pt = 2)
-    
-for index in ingredient_dict:
-    restr_dict['ingredient_'+index] = Restriction('ingredient_'+index, ingredient_dict[index].name, 'ingredient_'+index,
-                                                  "0.01*lp_var['ingredient_total']", 0, 100)
+def restriction_dict(oxide_dict, ingredient_dict, other_dict):
+    '''Return a dictionary with keys of the form 'umf_'+ox, 'mass_perc_'+ox, 'mole_perc_'+ox, 'ingredient_'+index
+       or 'other_'+index, whose values are the corresponding restrictions'''
+
+    restr_dict = {}
+
+    for ox in oxide_dict:   # create oxide restrictions
+        def_upp = 1   # default upper bound for oxide UMF
+        dp = 3
+        if ox == 'SiO2':
+            def_upp = 100
+            dp = 2
+        elif ox == 'Al2O3':
+            def_upp = 10
+        restr_dict['umf_'+ox] = Restriction('umf_'+ox, ox, 'mole_'+ox, umf_normalization, 0, def_upp, dec_pt = dp)
+        restr_dict['mass_perc_'+ox] = Restriction('mass_perc_'+ox, ox, 'mass_'+ox, mass_perc_normalization, 0, 100, dec_pt = 2) 
+        restr_dict['mole_perc_'+ox] = Restriction('mole_perc_'+ox, ox, 'mole_'+ox, mole_perc_normalization, 0, 100, dec_pt = 2)
+        
+    for index in ingredient_dict:
+        restr_dict['ingredient_'+index] = Restriction('ingredient_'+index, ingredient_dict[index].name, 'ingredient_'+index,
+                                                      ingredient_normalization, 0, 100)
+
+    for index in other_dict:
+        ot = other_dict[index]  
+        restr_dict['other_'+index] = Restriction('other_'+index, ot.name, 'other_'+index, ot.normalization, ot.def_low, ot.def_upp,
+                                                 dec_pt=ot.dec_pt)
 
-for index in other_dict:
-    ot = other_dict[index]  
-    restr_dict['other_'+index] = Restriction('other_'+index, ot.name, 'other_'+index, ot.normalization, ot.def_low, ot.def_upp,
-                                             dec_pt=ot.dec_pt)
+    return restr_dict
 
+restr_dict = restriction_dict(oxide_dict, ingredient_dict, other_dict)
@@ -0,0 +1,187 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# Random recipes satisfying all the restrictions, for test tile grids. Since every restriction is a homogeneous
+# linear inequality in the ingredient amounts, the recipes with ingredient percentages adding up to 100 form a
+# polytope, given by the constraint matrix of the reduced problem. It's sampled by hit-and-run: from the current
+# point, a random direction is chosen, and the next point is chosen uniformly on the chord of the polytope through
+# the current point in that direction. Many chains are run at once, so each step is a few matrix products.
+# Equalities, such as a restriction whose lower and upper bounds are the same, make the polytope lower
+# dimensional; they're found first, and the chains move within the affine subspace they define.
+
+import numpy as np
+from scipy.optimize import linprog
+
+import compositions
+
+# SECTION 1
+# Define RecipeSampler class
+
+class RecipeSampler:
+    '''A sampler of the recipes satisfying restriction_bounds, for the given RecipeModel. Use recipe_sampler to make
+       one, since the region may be empty. chains hit-and-run chains are run at once, starting from a point in
+       the middle of the region; after burn steps, the directions are drawn from the covariance of the chains,
+       which makes the walk mix faster in long, thin regions. One sample per chain is taken every thin steps.
+       The default burn and thin depend on the dimension of the region. rng is a numpy random Generator.
+       ingredients lists the recipe's ingredients, and compositions is the CompositionMatrix used for the analysis
+       of the samples, whose oxides and other attributes list the columns of the analysis'''
+
+    def __init__(self, model, problem, recipe_ingredients, recipe_oxides, recipe_other, x0, basis, G, h, center, rng,
+                 chains=100, burn=None, thin=None):
+
+        self.ingredients = list(recipe_ingredients)
+        self.columns = [self.ingredients.index(index) for index in problem.ingredient_columns]
+        self.x0 = x0
+        self.basis = basis           # x = x0 + basis @ z, for z satisfying G @ z <= h
+        self.G = G
+        self.h = h
+        self.rng = rng
+        self.dimension = basis.shape[1]
+        self.burn = 100*max(1, self.dimension) if burn is None else burn
+        self.thin = max(1, self.dimension) if thin is None else thin
+        self.directions = np.eye(self.dimension)
+
+        oxides = {ox: model.oxide_dict[ox] for ox in model.oxide_dict if ox in recipe_oxides}
+        comps = {index: model.ingredient_compositions[index] for index in self.ingredients}
+        other = {index: model.other_dict[index] for index in recipe_other}
+        self.compositions = compositions.CompositionMatrix(oxides, comps, other)
+
+        self.z = np.tile(center, (chains, 1))
+        self.slack = self.h - self.z @ self.G.T
+        if self.dimension > 0:
+            self.walk(self.burn)
+            if chains > self.dimension:
+                cov = np.cov(self.z.T).reshape(self.dimension, self.dimension)
+                ridge = 1e-9*max(np.trace(cov), 1e-12)/self.dimension
+                self.directions = np.linalg.cholesky(cov + ridge*np.eye(self.dimension))
+
+    def walk(self, steps):
+        'Move each chain the given number of steps'
+        for step in range(steps):
+            d = self.rng.standard_normal(self.z.shape) @ self.directions.T
+            a = d @ self.G.T                           # the rate at which the chains move towards each constraint
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = self.slack/a
+            t_max = np.where(a > 0, t, np.inf).min(axis=1, initial=np.inf)
+            t_min = np.where(a < 0, t, -np.inf).max(axis=1, initial=-np.inf)
+            t = t_min + (t_max - t_min)*self.rng.random(len(t_max))
+            t[~np.isfinite(t)] = 0          # in case a direction is parallel to every constraint
+            self.z += t[:, None]*d
+            self.slack -= t[:, None]*a
+            if step % 100 == 99:            # stop rounding errors from accumulating
+                self.slack = self.h - self.z @ self.G.T
+            np.maximum(self.slack, 0, out=self.slack)
+
+    def amounts(self, n):
+        'Return an array of n samples, one per row, giving the percentages of the ingredients in self.ingredients'
+        blocks = []
+        for k in range(-(-n//len(self.z))):
+            if self.dimension > 0:
+                self.walk(self.thin)
+            blocks.append(self.z.copy())
+        z = np.concatenate(blocks)[:n]
+        weights = np.zeros((n, len(self.ingredients)))
+        weights[:, self.columns] = np.maximum(self.x0 + z @ self.basis.T, 0)
+        return 100*weights/weights.sum(axis=1, keepdims=True)
+
+    def sample(self, n):
+        '''Return the analysis of n samples, as returned by compositions.CompositionMatrix.analyze_recipes: a dictionary
+           of arrays with one row per sample, 'ingredient' (the ingredient percentages, with columns as in
+           self.ingredients), 'umf', 'mass_perc', 'mole_perc' and 'other'. Each call continues the chains, so
+           further calls give further samples'''
+        return self.compositions.analyze_recipes(self.amounts(n), self.ingredients)
+
+    def stream(self, block_size=1000):
+        'Generator yielding the analysis of block_size samples at a time, indefinitely'
+        while True:
+            yield self.sample(block_size)
+
+# SECTION 2
+# Finding the region
+
+def recipe_sampler(model, restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other, seed=None, tol=1e-7,
+                   **options):
+    '''Return a pair (sampler, error), where sampler is a RecipeSampler for the recipes satisfying restriction_bounds, or
+       None if there are none, in which case error says why. seed is passed to numpy.random.default_rng, so the same
+       seed gives the same samples, and options are passed to RecipeSampler.
+       The region is found with a few LP solves. The constraints are the rows of A_ub of the reduced problem, and the
+       nonnegativity of the ingredients and of the normalizations of the restrictions (calc_restrictions fixes each
+       normalization at 1, so a restriction whose normalization is zero on the whole region is infeasible), with
+       the ingredient total fixed at 100. The constraints that are equalities on the whole region are found by
+       maximizing the total slack of the others, capped at 1 each: those with positive slack are strict somewhere,
+       and if none of the remaining ones are, they are all equalities. The average of the solutions is then in the
+       relative interior, and the chains start from the centre of the largest ball inside the region, within the
+       affine subspace defined by the equalities'''
+
+    problem = model.reduced_problem(restriction_bounds, recipe_ingredients, recipe_oxides, recipe_other)
+    n = problem.A_ub.shape[1]
+    if n == 0:
+        return None, 'No ingredients'
+    keys = dict.fromkeys(key for key, i in problem.labels if key is not None)
+    normalizations = np.unique([problem.linear_form(model.restr_dict[key].normalization) for key in keys], axis=0)
+    normalizations = normalizations.reshape(-1, n)
+    if (np.abs(normalizations).max(axis=1, initial=0) == 0).any():
+        return None, 'Infeasible'
+    G = np.vstack([problem.A_ub.toarray(), -np.eye(n), -normalizations])
+    G = G/np.linalg.norm(G, axis=1, keepdims=True)
+    E = np.vstack([problem.A_eq.toarray(), np.ones((1, n))])
+    b = np.zeros(len(E))
+    b[-1] = 100
+
+    unknown = np.arange(len(G))         # the constraints not yet known to be strict somewhere
+    points = []
+    while len(unknown) > 0:
+        S = np.zeros((len(G), len(unknown)))
+        S[unknown, np.arange(len(unknown))] = 1
+        c = np.concatenate([np.zeros(n), -np.ones(len(unknown))])
+        result = linprog(c, A_ub=np.hstack([G, S]), b_ub=np.zeros(len(G)),
+                         A_eq=np.hstack([E, np.zeros((len(E), len(unknown)))]), b_eq=b,
+                         bounds=[(None, None)]*n + [(0, 1)]*len(unknown), method='highs')
+        if result.status != 0:
+            return None, 'Infeasible' if result.status == 2 else result.message
+        points.append(result.x[:n])
+        strict = result.x[n:] > tol
+        if not strict.any():
+            break
+        unknown = unknown[~strict]
+    if (unknown >= len(G) - len(normalizations)).any():
+        return None, 'Infeasible'       # a normalization is zero on the whole region, so the restriction is undefined
+    x0 = np.mean(points, axis=0)
+
+    equalities = np.vstack([E, G[unknown]])
+    u, s, vt = np.linalg.svd(equalities)
+    rank = int((s > tol*max(s.max(), 1)).sum())
+    basis = vt[rank:].T                 # orthonormal basis of the directions within the region
+    inequalities = np.setdiff1d(np.arange(len(G)), unknown)
+    Gz = G[inequalities] @ basis
+    hz = -G[inequalities] @ x0
+    keep = np.linalg.norm(Gz, axis=1) > tol     # constraints that are constant on the region are satisfied at x0
+    Gz, hz = Gz[keep], hz[keep]
+
+    center = np.zeros(basis.shape[1])
+    if basis.shape[1] > 0 and len(Gz) > 0:
+        norms = np.linalg.norm(Gz, axis=1)
+        result = linprog(np.concatenate([np.zeros(basis.shape[1]), [-1]]), A_ub=np.hstack([Gz, norms[:, None]]),
+                         b_ub=hz, bounds=[(None, None)]*basis.shape[1] + [(0, None)], method='highs')
+        if result.status == 0:
+            center = result.x[:-1]
+
+    rng = np.random.default_rng(seed)
+    sampler = RecipeSampler(model, problem, recipe_ingredients, recipe_oxides, recipe_other, x0, basis, Gz, hz, center,
+                            rng, **options)
+    return sampler, None
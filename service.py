@@ -0,0 +1,344 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# A local JSON-RPC 2.0 service for calc_restrictions, so that an interface can keep calculating while the user edits
+# bounds. Messages are JSON objects, one per line, read from standard input and written to standard output, or
+# exchanged over a socket on localhost with --port. A request
+#   {"jsonrpc": "2.0", "id": 1, "method": "calc_restrictions",
+#    "params": {"restriction_bounds": {...}, "recipe_ingredients": [...], "recipe_other": [...], "session": "editor"}}
+# is answered by a notification for each restriction, as soon as both its bounds are known,
+#   {"jsonrpc": "2.0", "method": "bounds", "params": {"id": 1, "key": "umf_SiO2", "bounds": [3.0, 4.0]}}
+# followed by the response {"jsonrpc": "2.0", "id": 1, "result": {"calc_bounds": {...}, "error": null}}.
+# The calculations are made by a pool of threads, off the event loop. Identical requests that are in progress at the
+# same time share one calculation. A request with a session supersedes the previous request of that session on the
+# same connection, which is answered with an error, and {"method": "cancel", "params": {"id": 1}} cancels a request.
+# A calculation that no request is waiting for any more is stopped after the solve it's making.
+#   python service.py --workers 4
+#   python service.py --port 8765
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import calculations
+
+# JSON-RPC error codes
+parse_error = -32700
+invalid_request = -32600
+method_not_found = -32601
+invalid_params = -32602
+internal_error = -32603
+request_cancelled = -32800
+
+# SECTION 1
+# The service
+
+class Cancelled(Exception):
+    'Raised by the hook of a calculation that has been cancelled, to stop it between solves'
+
+def valid_id(value):
+    '''Return True if value can be used as a request id or a session: a string, an integer or None. Other JSON values
+       can't be used as dictionary keys (or, for floats, compared reliably), so they're rejected'''
+    return value is None or (isinstance(value, (str, int)) and not isinstance(value, bool))
+
+class Calculation:
+    '''A calculation in progress, and the requests waiting for it. subscribers is the list of (connection, request id,
+       restriction_bounds) of those requests, and bounds holds the bounds that are known so far'''
+
+    def __init__(self, key, restriction_bounds, recipe_ingredients, recipe_other, backend):
+
+        self.key = key
+        self.inputs = (restriction_bounds, recipe_ingredients, recipe_other, backend)
+        self.subscribers = []
+        self.bounds = {res_key: [None, None] for res_key in restriction_bounds}
+        self.cancelled = threading.Event()
+        self.task = None
+
+    def settle(self, key, i, value):
+        'Record bound i of restriction key, and once both its bounds are known, send them to the subscribers'
+        self.bounds[key][i] = value
+        if None not in self.bounds[key]:
+            for connection, request_id, restriction_bounds in self.subscribers:
+                connection.send_bounds(request_id, key, self.bounds[key])
+
+class Connection:
+    '''A client of the service. write is called with each message, encoded as a line of JSON. requests maps the ids of
+       the client's requests in progress to their calculations, and sessions maps each session to its latest request'''
+
+    def __init__(self, write):
+
+        self.write = write
+        self.requests = {}
+        self.sessions = {}
+        self.closed = False
+
+    def send(self, message):
+        if not self.closed:
+            message['jsonrpc'] = '2.0'
+            self.write((json.dumps(message) + '\n').encode())
+
+    def send_result(self, request_id, result):
+        self.send({'id': request_id, 'result': result})
+
+    def send_error(self, request_id, code, message):
+        self.send({'id': request_id, 'error': {'code': code, 'message': message}})
+
+    def send_bounds(self, request_id, key, bounds):
+        self.send({'method': 'bounds', 'params': {'id': request_id, 'key': key, 'bounds': list(bounds)}})
+
+class CalculationService:
+    '''Calculates the restrictions requested by the connections with model, in a pool of threads making up to
+       workers calculations at once. Threads rather than processes are used, so that a calculation can be stopped,
+       and its bounds sent, while it's running. The model's cache, if it has one, is used as in calc_restrictions.
+       backend is used for requests that don't give one'''
+
+    def __init__(self, model=calculations.default_model, workers=2, backend='simplex'):
+
+        self.model = model
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(workers)
+        self.running = {}     # key -> the Calculation in progress for requests with that key
+        self.loop = None
+
+    async def serve(self, readline, write, finish=False):
+        '''Handle the messages of one connection, read with the coroutine function readline until it returns an
+           empty line. Then the connection's requests are cancelled, unless finish is True, in which case
+           their results are sent first'''
+
+        self.loop = asyncio.get_running_loop()
+        connection = Connection(write)
+        while True:
+            line = await readline()
+            if not line:
+                break
+            if line.strip():
+                try:
+                    self.handle(connection, line)
+                except Exception as e:      # a bad message mustn't end the connection, or the requests in progress
+                    connection.send_error(None, internal_error, 'Internal error: ' + repr(e))
+        if finish:
+            tasks = {calc.task for calc in connection.requests.values()}
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for request_id in list(connection.requests):
+            self.unsubscribe(connection, request_id)
+        connection.closed = True
+
+    def handle(self, connection, line):
+        'Handle one message from connection'
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            connection.send_error(None, parse_error, 'Parse error: ' + str(e))
+            return
+        if not isinstance(message, dict) or not isinstance(message.get('method'), str):
+            connection.send_error(None, invalid_request, 'Invalid request')
+            return
+        request_id = message.get('id')
+        if not valid_id(request_id):
+            connection.send_error(None, invalid_request, 'Invalid request id: the id must be a string or an integer')
+            return
+        params = message.get('params', {})
+        if message['method'] == 'calc_restrictions':
+            if request_id is None:
+                connection.send_error(None, invalid_request, 'calc_restrictions requests need an id')
+            elif request_id in connection.requests:
+                connection.send_error(request_id, invalid_request, 'Request %r is already in progress' % (request_id,))
+            else:
+                self.calc_restrictions(connection, request_id, params)
+        elif message['method'] == 'cancel':
+            cancel_id = params.get('id') if isinstance(params, dict) else None
+            if not valid_id(cancel_id):
+                if request_id is not None:
+                    connection.send_error(request_id, invalid_params, 'The id to cancel must be a string or an integer')
+                return
+            found = cancel_id in connection.requests
+            if found:
+                connection.send_error(cancel_id, request_cancelled, 'Request cancelled')
+                self.unsubscribe(connection, cancel_id)
+            if request_id is not None:
+                connection.send_result(request_id, found)
+        elif request_id is not None:
+            connection.send_error(request_id, method_not_found, 'Method not found: ' + message['method'])
+
+    def calc_restrictions(self, connection, request_id, params):
+        '''Start the calculation for a calc_restrictions request, or add the request to an identical calculation in
+           progress, or answer it from the cache'''
+
+        model = self.model
+        if not (isinstance(params, dict) and isinstance(params.get('restriction_bounds'), dict)
+                and isinstance(params.get('recipe_ingredients'), list) and isinstance(params.get('recipe_other', []), list)):
+            connection.send_error(request_id, invalid_params,
+                                  'Expected params with restriction_bounds, recipe_ingredients and recipe_other')
+            return
+        restriction_bounds = params['restriction_bounds']
+        recipe_ingredients = params['recipe_ingredients']
+        recipe_other = params.get('recipe_other', [])
+        backend = params.get('backend', self.backend)
+        if not isinstance(backend, str) or backend not in model.backends:
+            connection.send_error(request_id, invalid_params, 'Unknown backend: %r' % (backend,))
+            return
+        try:
+            canonical = cache.canonical_inputs(model, restriction_bounds, recipe_ingredients, recipe_other, backend)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            connection.send_error(request_id, invalid_params, 'Invalid params: ' + repr(e))
+            return
+        key = hashlib.sha256(repr(canonical).encode()).hexdigest()      # the same as cache.ResultCache.key
+
+        session = params.get('session')
+        if not valid_id(session):
+            connection.send_error(request_id, invalid_params, 'Invalid session: it must be a string or an integer')
+            return
+        if session is not None:
+            previous = connection.sessions.get(session)
+            if previous in connection.requests:
+                connection.send_error(previous, request_cancelled, 'Superseded by request %r' % (request_id,))
+                self.unsubscribe(connection, previous)
+            connection.sessions[session] = request_id
+
+        if model.cache is not None:
+            calc_bounds = model.cache.get(key, restriction_bounds)
+            if calc_bounds is not None:
+                for res_key, bounds in calc_bounds.items():
+                    connection.send_bounds(request_id, res_key, bounds)
+                connection.send_result(request_id, {'calc_bounds': calc_bounds, 'error': None})
+                return
+
+        calc = self.running.get(key)
+        if calc is None:
+            calc = Calculation(key, restriction_bounds, recipe_ingredients, recipe_other, backend)
+            self.running[key] = calc
+            calc.task = asyncio.ensure_future(self.run(calc))
+        else:
+            for res_key, bounds in calc.bounds.items():
+                if None not in bounds:
+                    connection.send_bounds(request_id, res_key, bounds)
+        calc.subscribers.append((connection, request_id, restriction_bounds))
+        connection.requests[request_id] = calc
+
+    def unsubscribe(self, connection, request_id):
+        'Stop waiting for a request, and cancel its calculation if no other request is waiting for it'
+        calc = connection.requests.pop(request_id)
+        calc.subscribers = [s for s in calc.subscribers if s[0] is not connection or s[1] != request_id]
+        if not calc.subscribers:
+            calc.cancelled.set()
+            if self.running.get(calc.key) is calc:
+                del self.running[calc.key]
+
+    async def run(self, calc):
+        'Make the calculation in the pool, and send the result to the requests waiting for it'
+        try:
+            calc_bounds, error = await self.loop.run_in_executor(self.executor, self.calculate, calc)
+        except Cancelled:
+            return
+        except Exception as e:
+            calc_bounds, error = None, 'Calculation failed: ' + repr(e)
+        finally:
+            if self.running.get(calc.key) is calc:
+                del self.running[calc.key]
+        if self.model.cache is not None:
+            self.model.cache.put(calc.key, calc_bounds)
+        for connection, request_id, restriction_bounds in calc.subscribers:
+            if calc_bounds is not None:
+                result = {res_key: calc_bounds[res_key] for res_key in restriction_bounds}
+            else:
+                result = None
+            connection.send_result(request_id, {'calc_bounds': result, 'error': error})
+            del connection.requests[request_id]
+        calc.subscribers = []
+
+    def calculate(self, calc):
+        '''Calculate the restrictions, in a worker thread. Each bound is passed to the event loop as soon as it's
+           known, and the calculation is stopped after the current solve if it's cancelled'''
+
+        if calc.cancelled.is_set():
+            raise Cancelled
+
+        def check(solve):
+            if calc.cancelled.is_set():
+                raise Cancelled
+
+        def settle(key, i, value):
+            self.loop.call_soon_threadsafe(calc.settle, key, i, value)
+
+        restriction_bounds, recipe_ingredients, recipe_other, backend = calc.inputs
+        calc_bounds, report = self.model.calc_report(restriction_bounds, recipe_ingredients, recipe_other, backend,
+                                                     hooks=[check], bound_hooks=[settle])
+        return calc_bounds, report.error
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# SECTION 2
+# Running the service on standard input and output, or on a socket
+
+async def serve_stdio(service):
+    'Serve requests read from standard input, writing to standard output, until the end of the input'
+    loop = asyncio.get_running_loop()
+
+    async def readline():
+        return await loop.run_in_executor(None, sys.stdin.buffer.readline)
+
+    def write(data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    await service.serve(readline, write, finish=True)
+
+async def serve_socket(service, host, port):
+    'Serve requests from connections to host:port, until the process is stopped'
+
+    async def handle_client(reader, writer):
+        try:
+            await service.serve(reader.readline, writer.write)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_client, host, port, limit=2**24)
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve calc_restrictions requests as JSON-RPC, one message per line')
+    parser.add_argument('--port', type=int, help='listen on this port, instead of using standard input and output')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--workers', type=int, default=2, help='number of calculations made at the same time')
+    parser.add_argument('--backend', default='simplex', choices=sorted(calculations.RecipeModel.backends))
+    parser.add_argument('--cache', type=int, default=0, help='number of results to cache (default: none)')
+    args = parser.parse_args(argv)
+
+    model = calculations.default_model
+    if args.cache:
+        model.cache = cache.ResultCache(args.cache)
+    service = CalculationService(model, args.workers, args.backend)
+    try:
+        if args.port is None:
+            asyncio.run(serve_stdio(service))
+        else:
+            asyncio.run(serve_socket(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == '__main__':
+    main()
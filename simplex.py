@@ -0,0 +1,303 @@
+# LIPGLOSS - Graphical user interface for constructing glaze recipes
+# Copyright (C) 2017 Pieter Mostert
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# version 3 along with this program (see LICENCE.txt).  If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Contact: pi.mostert@gmail.com
+
+# A small dense simplex method that keeps its basis between solves. The problems calc_restrictions solves
+# only differ in their objective (and normalization), so after the first solve, a feasible basis is
+# usually at hand and the two-phase method can go straight to phase 2.
+
+import numpy as np
+import scipy.linalg
+from scipy.optimize import linprog
+
+highs_statuses = {1: 'Iteration limit reached', 2: 'Infeasible', 3: 'Unbounded', 4: 'Numerical difficulties'}
+
+class Simplex:
+    '''Minimize c.x subject to A x = b, x >= 0. The rows of A and b may be changed between solves
+       with set_row, in which case the last basis is used as a starting point if it's still feasible.
+       The rows and columns of A are scaled, and each cost vector is scaled to a largest entry of 1, so the
+       tolerances are relative. x, value and reduced costs are given in terms of the original problem'''
+
+    def __init__(self, A, b, tol=1e-9, pivot_tol=1e-7, feas_tol=1e-7, max_pivots=5000):
+
+        A = np.array(A, dtype=float)
+        self.row_scale, self.col_scale = scaling(A)
+        self.A = self.row_scale[:, None]*A*self.col_scale
+        self.b = self.row_scale*np.array(b, dtype=float)
+        self.tol = tol
+        self.pivot_tol = pivot_tol       # smallest acceptable pivot element in the ratio test
+        self.feas_tol = feas_tol         # largest infeasibility, relative to the size of the solution
+        self.max_pivots = max_pivots
+        self.basis = None      # list of the indices of the basic columns, one for each row
+        self.T = None          # the tableau B^-1 [A b], or None if it needs to be recomputed
+        self.y = None          # the duals, if the last solve was made by HiGHS and no basis was recovered
+
+        self.pivots = 0                 # total number of pivots
+        self.phase1_pivots = 0          # number of pivots used to find a feasible basis on the last cold start
+        self.cold_starts = 0
+        self.warm_starts = 0
+        self.pivots_saved = 0           # estimated number of phase 1 pivots avoided by warm starts
+        self.fallbacks = 0              # number of solves handed over to HiGHS
+        self.since_factor = 0
+
+    def set_row(self, i, row, rhs):
+        '''Replace row i of the constraints A x = b. Since phase 1 may remove redundant rows,
+           rows that are going to be changed should be referred to by negative indices'''
+        row = np.asarray(row, dtype=float)*self.col_scale
+        size = np.abs(row).max()
+        self.row_scale[i] = 1/size if size > 0 else 1
+        self.A[i] = self.row_scale[i]*row
+        self.b[i] = self.row_scale[i]*rhs
+        self.T = None
+
+    def factor(self):
+        '''Recompute the tableau from the current basis. Returns False if the basis is singular
+           or isn't feasible for the current constraints'''
+        if self.basis is None:
+            return False
+        try:
+            T = np.linalg.solve(self.A[:, self.basis], np.column_stack([self.A, self.b]))
+        except np.linalg.LinAlgError:
+            return False
+        if not np.all(np.isfinite(T)) or np.abs(T[:, :-1]).max() > 1/self.tol:
+            return False      # the basis is too close to singular for the tableau to be accurate
+        if (T[:, -1] < -self.feas_tol*max(1, np.abs(T[:, -1]).max())).any():
+            return False
+        T[:, -1] = np.maximum(T[:, -1], 0)
+        self.T = T
+        self.since_factor = 0
+        return True
+
+    def pivot(self, T, basis, r, e):
+        T[r] /= T[r, e]
+        col = T[:, e].copy()
+        col[r] = 0
+        T -= np.outer(col, T[r])
+        T[:, -1] = np.maximum(T[:, -1], 0)      # the basis stays feasible; negative values are rounding errors
+        basis[r] = e
+        self.pivots += 1
+        self.since_factor += 1
+
+    def iterate(self, T, basis, cost):
+        '''Pivot until the basis is optimal for the given costs. Uses Dantzig's rule, switching to
+           Bland's rule after a run of degenerate pivots to avoid cycling.
+           Returns 'Optimal', 'Unbounded' or 'Iteration limit reached' '''
+        n = T.shape[1] - 1
+        degenerate = 0
+        for count in range(self.max_pivots):
+            d = cost[:n] - cost[basis] @ T[:, :n]      # reduced costs
+            if degenerate > 50:
+                candidates = np.nonzero(d < -self.tol)[0]
+                if len(candidates) == 0:
+                    return 'Optimal'
+                e = candidates[0]
+            else:
+                e = np.argmin(d)
+                if d[e] >= -self.tol:
+                    return 'Optimal'
+            col = T[:, e]
+            rows = np.nonzero(col > self.pivot_tol)[0]
+            if len(rows) == 0:
+                return 'Unbounded'
+            ratios = T[rows, -1] / col[rows]
+            ties = rows[ratios <= ratios.min() + self.tol]
+            r = min(ties, key=lambda i: basis[i])            # smallest basic index among ties
+            if T[r, -1] <= self.tol:
+                degenerate += 1
+            else:
+                degenerate = 0
+            self.pivot(T, basis, r, e)
+        return 'Iteration limit reached'
+
+    def scaled_costs(self, c):
+        'Return the cost vector c (or each row of the matrix c) in terms of the scaled columns, with a largest entry of 1'
+        c = np.asarray(c, dtype=float)*self.col_scale
+        size = np.abs(c).max(axis=-1, keepdims=True)
+        return c/np.where(size > 0, size, 1)
+
+    def reduced_costs(self, c):
+        '''Return the reduced costs of the cost vector c (or of each row of the matrix c) for the current basis.
+           Only valid straight after an optimal solve'''
+        c = np.asarray(c, dtype=float)
+        if self.T is None:           # the solve was made by HiGHS
+            return c - (self.A.T @ self.y)/self.col_scale
+        n = self.T.shape[1] - 1
+        scaled = c*self.col_scale
+        return (scaled - scaled[..., self.basis] @ self.T[:, :n])/self.col_scale
+
+    def is_optimal(self, C):
+        '''Return a boolean array saying, for each row c of C, whether the current basis is also optimal for minimizing c.x.
+           If there is no basis, because the last solve was made by HiGHS, the answer is False'''
+        if self.T is None:
+            return np.zeros(len(C), dtype=bool)
+        C = self.scaled_costs(C)
+        n = self.T.shape[1] - 1
+        return (C - C[:, self.basis] @ self.T[:, :n] >= -self.tol).all(axis=1)
+
+    def basis_value(self, c, basis):
+        '''Return the minimum of c.x if basis is a feasible and optimal basis for the current constraints, and None
+           otherwise. Only B^-1 b and the duals are worked out, so it's much cheaper than a solve, and the current
+           basis and tableau are kept'''
+        if basis is None or len(basis) != self.A.shape[0]:
+            return None
+        basis = list(basis)
+        cost = self.scaled_costs(c)
+        B = self.A[:, basis]
+        try:
+            x = np.linalg.solve(B, self.b)
+            y = np.linalg.solve(B.T, cost[basis])
+        except np.linalg.LinAlgError:
+            return None
+        if not np.all(np.isfinite(x)) or np.abs(x).max(initial=0) > 1/self.tol:
+            return None
+        if (x < -self.feas_tol*max(1, np.abs(x).max(initial=0))).any() or (cost - self.A.T @ y < -self.tol).any():
+            return None
+        return np.asarray(c, dtype=float)[basis] @ (x*self.col_scale[basis])
+
+    def phase1(self):
+        '''Find a feasible basis from scratch, using artificial variables. Rows found to be redundant
+           are removed. Returns 'Optimal' if a feasible basis was found'''
+        m, n = self.A.shape
+        sign = np.where(self.b < 0, -1.0, 1.0)
+        T = np.column_stack([sign[:, None]*self.A, np.eye(m), sign*self.b])
+        basis = list(range(n, n + m))
+        cost = np.r_[np.zeros(n), np.ones(m)]
+        start = self.pivots
+        status = self.iterate(T, basis, np.r_[cost, 0])
+        self.phase1_pivots = self.pivots - start
+        self.cold_starts += 1
+        if status != 'Optimal':
+            return status
+        if T[:, -1] @ cost[basis] > self.feas_tol*max(1, T[:, -1].max()):
+            return 'Infeasible'
+
+        redundant = []
+        for i in range(m):      # drive the artificial variables out of the basis
+            if basis[i] >= n:
+                e = np.argmax(np.abs(T[i, :n]))      # the largest pivot element is the most stable choice
+                if abs(T[i, e]) > self.pivot_tol:
+                    self.pivot(T, basis, i, e)
+                else:
+                    redundant.append(i)
+        if redundant:
+            keep = [i for i in range(m) if i not in redundant]
+            self.A = self.A[keep]
+            self.b = self.b[keep]
+            self.row_scale = self.row_scale[keep]
+            basis = [basis[i] for i in keep]
+        self.basis = basis
+        if not self.factor():
+            return 'Numerical difficulties'
+        return 'Optimal'
+
+    def solve(self, c, basis=None, fallback=False):
+        '''Minimize c.x, starting from the last basis (or the given basis) if possible. Returns the status;
+           if it's 'Optimal', the optimal value and solution are stored in self.value and self.x. If fallback
+           is True and the simplex method fails (which can happen on badly conditioned problems, for which
+           phase 1 may wrongly find them infeasible), the problem is solved again with HiGHS'''
+        c = np.asarray(c, dtype=float)
+        cost = self.scaled_costs(c)
+        self.y = None
+        if basis is not None and len(basis) == self.A.shape[0]:
+            self.basis = list(basis)
+            self.T = None
+        if self.T is not None and self.since_factor < 100:
+            warm = True
+        else:
+            warm = self.factor()      # also refactors periodically, to limit the build-up of rounding errors
+        if warm:
+            self.warm_starts += 1
+            self.pivots_saved += self.phase1_pivots
+            status = 'Optimal'
+        else:
+            status = self.phase1()
+        if status == 'Optimal':
+            status = self.iterate(self.T, self.basis, np.r_[cost, 0])
+        if status == 'Optimal':
+            self.solution(c)
+        elif fallback:
+            status = self.solve_highs(c)
+        else:
+            self.basis = None
+            self.T = None
+        return status
+
+    def solution(self, c):
+        'Store the basic solution of the current tableau, and its value for the cost vector c'
+        self.x = np.zeros(self.A.shape[1])
+        self.x[self.basis] = self.T[:, -1]
+        self.x *= self.col_scale
+        self.value = c @ self.x
+
+    def solve_highs(self, c):
+        '''Minimize c.x with HiGHS, from scratch. If a basis whose basic solution is the optimal point can be found,
+           the simplex method carries on from there, so later solves can start from it; otherwise the duals
+           are kept for reduced_costs, and the next solve starts with phase 1'''
+        self.fallbacks += 1
+        self.basis = None
+        self.T = None
+        result = linprog(c*self.col_scale, A_eq=self.A, b_eq=self.b, bounds=(0, None), method='highs')
+        if result.status != 0:
+            return highs_statuses.get(result.status, 'No solution. Problem status '+str(result.status))
+        if self.crossover(result.x) and self.iterate(self.T, self.basis, np.r_[self.scaled_costs(c), 0]) == 'Optimal':
+            self.solution(c)
+        else:
+            self.basis = None
+            self.T = None
+            self.y = result.eqlin.marginals
+            self.x = result.x*self.col_scale
+            self.value = c @ self.x
+        return 'Optimal'
+
+    def crossover(self, x):
+        '''Find a basis whose basic solution is the vertex x (of the scaled problem), by completing the columns in
+           the support of x to a basis with the columns that are furthest from their span. Returns True if it
+           could be found and factored'''
+        m, n = self.A.shape
+        support = np.nonzero(x > self.tol*max(1, x.max()))[0]
+        if len(support) > m:
+            return False
+        others = np.setdiff1d(np.arange(n), support)
+        rest = self.A[:, others]
+        if len(support):
+            Q, R = np.linalg.qr(self.A[:, support])
+            if np.abs(np.diag(R)).min() <= self.pivot_tol:
+                return False
+            rest = rest - Q @ (Q.T @ rest)
+        k = m - len(support)
+        if k > 0:
+            R, order = scipy.linalg.qr(rest, mode='r', pivoting=True)
+            if min(R.shape) < k or abs(R[k-1, k-1]) <= self.pivot_tol:
+                return False
+            support = np.r_[support, others[order[:k]]]
+        self.basis = [int(j) for j in support]
+        return self.factor()
+
+def scaling(A, rounds=10):
+    '''Return the row and column scale factors r and s for which the largest entry of each row and column of
+       diag(r) A diag(s) is close to 1 (Ruiz equilibration: each round divides the rows and columns by the square
+       roots of their largest entries). Geometric mean scaling, which balances the largest and smallest entries,
+       can shrink small entries below the pivot tolerance, so that the ratio test ignores their constraints'''
+    A = np.abs(A)
+    row, col = np.ones(A.shape[0]), np.ones(A.shape[1])
+    for k in range(rounds):
+        S = A*row[:, None]*col
+        big = S.max(axis=1, initial=0)
+        row /= np.sqrt(np.where(big > 0, big, 1))
+        big = S.max(axis=0, initial=0)
+        col /= np.sqrt(np.where(big > 0, big, 1))
+    return row, col